@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# Import-time benchmark for the client entry point (launch.py -> Wolfpackmaker).
+# Runs the import in fresh interpreters with -X importtime and reports the median and the slowest modules.
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+from os.path import dirname
+
+
+def measure(module):
+    r = subprocess.run([sys.executable, '-X', 'importtime', '-c', module and f'import {module}' or 'pass'],
+                       cwd=dirname(__file__) or '.', capture_output=True, text=True, check=True)
+    # e.g "import time:       955 |     110761 | wolfpackmaker.wolfpackmaker"
+    modules = {}
+    for line in r.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        modules[name.strip()] = int(cumulative)
+    return modules.get(module, 0), modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Wolfpackmaker import-time benchmark')
+    parser.add_argument('-m', '--module', help='Module to import. Defaults to wolfpackmaker.wolfpackmaker.',
+                        default='wolfpackmaker.wolfpackmaker')
+    parser.add_argument('-n', '--runs', help='Amount of runs. Defaults to 5.', type=int, default=5)
+    parser.add_argument('--budget', help='Fail when the median import time is over this many milliseconds.', type=float)
+    args = parser.parse_args()
+    runs = [measure(args.module) for _ in range(args.runs)]
+    median = statistics.median(total for total, _ in runs) / 1000
+    print(f"{args.module}: {median:.1f} ms median over {args.runs} runs")
+    # Leave out what the interpreter imports at startup anyway (site and whatever .pth files pull in)
+    _, startup = measure(None)
+    _, modules = runs[-1]
+    top_level = {name: t for name, t in modules.items() if '.' not in name and name != args.module and name not in startup}
+    for name, t in sorted(top_level.items(), key=lambda m: m[1], reverse=True)[:10]:
+        print(f"  {t / 1000:8.1f} ms  {name}")
+    if args.budget is not None and median > args.budget:
+        sys.exit(f"Import time {median:.1f} ms is over the {args.budget:.0f} ms budget")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,143 @@
 from genericpath import exists
-import requests
-
-from os import remove
-from os.path import getsize, dirname, realpath, basename
-from rich.traceback import install as init_traceback
+from appdirs import user_cache_dir
+from os import makedirs, replace
+from os.path import dirname, join, realpath, basename
+from threading import Lock, Thread
 import asyncio
+import hashlib
+import json
+import sys
+import time
 
-self_file = requests.get("https://raw.githubusercontent.com/WolfpackMC/wolfpackmaker/master/src/wolfpackmaker/wolfpackmaker.py", headers={'User-Agent': 'kalka.io'})
-util_file = requests.get("https://raw.githubusercontent.com/WolfpackMC/wolfpackmaker/master/src/wolfpackmaker/util.py", headers={'User-Agent': 'kalka.io'})
+UPDATE_URL = "https://raw.githubusercontent.com/WolfpackMC/wolfpackmaker/master/src/wolfpackmaker/{}"
+UPDATE_FILES = ['wolfpackmaker.py', 'util.py']
+UPDATE_TTL = 60 * 60  # seconds between update checks
+UPDATE_RETRY_TTL = 10 * 60  # seconds before a failed or unfinished check is tried again
+UPDATE_TIMEOUT = (3, 5)  # connect, read
+UPDATE_WAIT = 3  # seconds the launch waits for the check before going ahead with the current files
 
 file_path = dirname(__file__)
+update_info_path = join(user_cache_dir('wolfpackmaker'), 'launch.json')
+
+# Once the launch goes on to import the client, the update check may no longer swap files in under it
+swap_lock = Lock()
+launch_started = False
+
+
+def get_sha1(path):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
 
-if len(self_file.content) != getsize(f"{file_path}/wolfpackmaker/wolfpackmaker.py"):
-    print("Updating wolfpackmaker.py...")
-    with open(realpath(f"{file_path}/wolfpackmaker/wolfpackmaker.py"), 'wb') as f:
-         f.write(self_file.content)
-if len(util_file.content) != getsize(f"{file_path}/wolfpackmaker/util.py"):
-    print("Updating util.py...")
-    with open(realpath(f"{file_path}/wolfpackmaker/util.py"), 'wb') as f:
-         f.write(util_file.content)
+
+def read_update_info():
+    try:
+        with open(update_info_path, 'r') as f:
+            return json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_update_info(update_info):
+    makedirs(dirname(update_info_path), exist_ok=True)
+    with open(update_info_path, 'w') as f:
+        f.write(json.dumps(update_info))
+
+
+def self_update():
+    # The version manifest keeps the ETag and sha1 of each file as last downloaded. A file is only fetched again
+    # when GitHub says it changed, or when the local copy no longer matches the hash it was saved with.
+    update_info = read_update_info()
+    if time.time() - update_info.get('checked', 0) < UPDATE_TTL or time.time() - update_info.get('attempted', 0) < UPDATE_RETRY_TTL:
+        return
+    # Recorded before going online, so a check that hangs on a dead network is not retried on every launch,
+    # even when the launch exits before it times out
+    update_info['attempted'] = time.time()
+    save_update_info(update_info)
+    import requests
+    files = update_info.setdefault('files', {})
+    downloaded = {}
+    try:
+        with requests.Session() as session:
+            session.headers.update({'User-Agent': 'kalka.io'})
+            for name in UPDATE_FILES:
+                path = realpath(f"{file_path}/wolfpackmaker/{name}")
+                info = files.get(name, {})
+                local_sha1 = get_sha1(path)
+                headers = {}
+                if info.get('etag') and info.get('sha1') == local_sha1:
+                    headers['If-None-Match'] = info['etag']
+                r = session.get(UPDATE_URL.format(name), headers=headers, timeout=UPDATE_TIMEOUT)
+                if r.status_code == 304:
+                    continue
+                r.raise_for_status()
+                sha1 = hashlib.sha1(r.content).hexdigest()
+                files[name] = {'etag': r.headers.get('etag'), 'sha1': sha1}
+                if sha1 != local_sha1:
+                    downloaded[path] = r.content
+    except requests.RequestException as e:
+        print(f"Could not check for updates ({e!r}), continuing with the current version.", file=sys.stderr)
+        return
+    # Write everything first, then swap the files in, so wolfpackmaker.py and util.py are updated together.
+    # When the launch already went ahead, the files stay staged and are swapped in at the start of the next one.
+    for path, content in downloaded.items():
+        with open(f"{path}.new", 'wb') as f:
+            f.write(content)
+    with swap_lock:
+        if launch_started:
+            update_info['staged'] = list(downloaded)
+        else:
+            for path in downloaded:
+                print(f"Updating {basename(path)}...", file=sys.stderr)
+                replace(f"{path}.new", path)
+        update_info['checked'] = time.time()
+        save_update_info(update_info)
+
+
+def apply_staged_update():
+    update_info = read_update_info()
+    staged = update_info.pop('staged', [])
+    if not staged:
+        return
+    # All or nothing, a half staged update is dropped and fetched again on the next check
+    if all(exists(f"{path}.new") for path in staged):
+        for path in staged:
+            print(f"Updating {basename(path)}...", file=sys.stderr)
+            replace(f"{path}.new", path)
+    else:
+        update_info['checked'] = 0
+    save_update_info(update_info)
+
+
+def print_traceback(*exc_info):
+    # Same as rich.traceback.install, without importing it (and pygments) on every launch
+    from rich.traceback import Traceback
+    w.log.print(Traceback.from_exception(*exc_info))
+
+
+apply_staged_update()
+updater = Thread(target=self_update, daemon=True)
+updater.start()
+updater.join(UPDATE_WAIT)
+with swap_lock:
+    launch_started = True
+if updater.is_alive():
+    print("Update check is taking too long, continuing with the current version.", file=sys.stderr)
 
 from wolfpackmaker.wolfpackmaker import Wolfpackmaker, get_spinner
 
 if __name__ == "__main__":
     w = Wolfpackmaker()
-    init_traceback(console=w.log)
+    sys.excepthook = print_traceback
     w.main()
     w.create_folders()
-    w.log.fancy_intro(description=f"Wolfpackmaker / {Wolfpackmaker.VERSION}")
+    if w.args.serve:
+        w.serve()
+        sys.exit()
+    if not w.args.no_banner:
+        w.log.fancy_intro(description=f"Wolfpackmaker / {Wolfpackmaker.VERSION}")
     w.loop = asyncio.new_event_loop()
     try:
         w.loop.run_until_complete(
@@ -35,22 +145,12 @@ if __name__ == "__main__":
         )
     except KeyboardInterrupt:
         try:
-            w.progress.update(w.progress_task, description=f"[red]{w.progress_task.description}")
+            w.progress.cancel()
         except AttributeError:
             pass
         w.log.info("Canceling!")
-        try:
-            w.log.info(f"Flagging {w.current_mod} for deletion as it was in the middle of being downloaded")
-            try:
-                remove(f"{w.mods_dir}/{w.current_mod}")
-            except FileNotFoundError:
-                pass
-            try:
-                remove(f"{w.mods_cache_dir}/{w.current_mod}")
-            except FileNotFoundError:
-                pass
-        except AttributeError:
-            pass
+        for current_mod in w.current_mods:
+            w.log.info(f"Keeping the partial download of {current_mod}, it will resume on the next run")
     if not w.args.noninteractive:
         download_url = ''
         filename = ''
@@ -83,6 +183,7 @@ if __name__ == "__main__":
                 from rich import inspect
                 inspect(w.minecraft_version)
                 w.log.info(f"Downloading OptiFine ({filename})...")
+                import requests
                 optifine_file = requests.get(download_url, stream=True)
                 with open(f"{w.mods_dir}/{filename}", "wb") as f:
                     for c in optifine_file.iter_content():
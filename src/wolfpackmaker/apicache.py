@@ -0,0 +1,126 @@
+import aiohttp
+import asyncio
+import json
+import re
+import sqlite3
+import time
+
+from appdirs import user_cache_dir
+from pathlib import Path
+
+
+ADDON_TTL = 60 * 60 * 24  # Addon records change whenever a mod gets a new file
+FILE_URL = re.compile(r'/addon/\d+/file/\d+/?$')  # File records never change once uploaded
+BATCH_SIZE = 100  # ids per batched request
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    body TEXT,
+    expires REAL
+);
+"""
+
+
+class ApiCache:
+    """On-disk cache of CurseForge API responses, shared by lock.py, modpackmaker.py and raw_mod_list.py."""
+
+    def __init__(self, path=None, addon_ttl=ADDON_TTL):
+        path = Path(path or Path(user_cache_dir('wolfpackmaker')) / 'api_cache.db')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.addon_ttl = addon_ttl
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def get(self, url):
+        row = self.db.execute("SELECT body, expires FROM responses WHERE url = ?", (url,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return row[0]
+
+    def set(self, url, body):
+        expires = None if FILE_URL.search(url) else time.time() + self.addon_ttl
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (url, body, expires))
+
+    def get_json(self, url):
+        body = self.get(url)
+        return body and json.loads(body)
+
+    def set_json(self, url, data):
+        self.set(url, json.dumps(data))
+
+    async def get_addons(self, session, curseforge_url, ids, jobs=8):
+        """Addons by id, from the cache where possible and batched POST /addon requests for the rest."""
+        addons = {}
+        missing = []
+        for mod_id in ids:
+            addon = self.get_json(f"{curseforge_url}{mod_id}")
+            if addon is None:
+                missing.append(mod_id)
+            else:
+                addons[mod_id] = addon
+        for batch in chunks(missing, BATCH_SIZE):
+            try:
+                async with session.post(curseforge_url.rstrip('/'), json=batch) as r:
+                    r.raise_for_status()
+                    results = await r.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                results = await self.fetch_each(session, [f"{curseforge_url}{mod_id}" for mod_id in batch], jobs)
+            for addon in results:
+                if addon is None:
+                    continue
+                addons[addon['id']] = addon
+                self.set_json(f"{curseforge_url}{addon['id']}", addon)
+        return addons
+
+    async def get_files(self, session, curseforge_url, files, jobs=8):
+        """Files by (project id, file id), from the cache where possible and batched POST /addon/files requests for the rest."""
+        found = {}
+        missing = {}
+        for project_id, file_id in files:
+            url = f"{curseforge_url}{project_id}/file/{file_id}"
+            file = self.get_json(url)
+            if file is None:
+                missing[file_id] = url
+            else:
+                found[file_id] = file
+        for batch in chunks(list(missing), BATCH_SIZE):
+            try:
+                async with session.post(f"{curseforge_url}files", json=batch) as r:
+                    r.raise_for_status()
+                    # e.g {"3245356": [{"id": 3245356, ...}]}
+                    results = [f for file_id, fs in (await r.json()).items() for f in fs if f['id'] == int(file_id)]
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                results = await self.fetch_each(session, [missing[file_id] for file_id in batch], jobs)
+            for file in results:
+                if file is None or file['id'] not in missing:
+                    continue
+                found[file['id']] = file
+                self.set_json(missing[file['id']], file)
+        return found
+
+    async def fetch_each(self, session, urls, jobs):
+        # Fallback for when the batched endpoints are unavailable, one bounded request per item
+        slots = asyncio.Semaphore(jobs)
+
+        async def fetch(url):
+            async with slots:
+                try:
+                    async with session.get(url) as r:
+                        r.raise_for_status()
+                        return await r.json()
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                    return None
+
+        return await asyncio.gather(*[fetch(url) for url in urls])
+
+    def close(self):
+        self.db.close()
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
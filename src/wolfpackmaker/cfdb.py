@@ -0,0 +1,109 @@
+import gzip
+import json
+import shutil
+import sqlite3
+
+from pathlib import Path
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mods (
+    id INTEGER PRIMARY KEY,
+    slug TEXT,
+    name TEXT,
+    summary TEXT,
+    latest_files TEXT
+);
+CREATE INDEX IF NOT EXISTS mods_slug ON mods (slug);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def to_row(mod):
+    return mod["id"], mod["slug"], mod["name"], mod.get("summary"), json.dumps(mod.get("latest_files") or [])
+
+
+def from_row(row):
+    return {
+        "id": row[0],
+        "slug": row[1],
+        "name": row[2],
+        "summary": row[3],
+        "latest_files": json.loads(row[4])
+    }
+
+
+def write_db(mods, path):
+    db = sqlite3.connect(path)
+    with db:
+        db.executescript(SCHEMA)
+        db.executemany("INSERT OR REPLACE INTO mods VALUES (?, ?, ?, ?, ?)", (to_row(m) for m in mods))
+    db.close()
+
+
+def merge_db(src, dst):
+    # Rows from src replace the ones with the same id in dst
+    db = sqlite3.connect(dst)
+    db.executescript(SCHEMA)
+    db.execute("ATTACH DATABASE ? AS src", (str(src),))
+    with db:
+        db.execute("INSERT OR REPLACE INTO mods SELECT * FROM src.mods")
+    db.execute("DETACH DATABASE src")
+    db.close()
+
+
+def read_mods(path):
+    db = sqlite3.connect(path)
+    mods = [from_row(row) for row in db.execute("SELECT * FROM mods ORDER BY id")]
+    db.close()
+    return mods
+
+
+def write_meta(path, key, value):
+    db = sqlite3.connect(path)
+    with db:
+        db.executescript(SCHEMA)
+        db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+    db.close()
+
+
+def read_meta(path, key):
+    db = sqlite3.connect(path)
+    try:
+        row = db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    except sqlite3.OperationalError:  # Written before the meta table existed
+        row = None
+    db.close()
+    return row and row[0]
+
+
+def compress_db(path):
+    # The .gz variant is what gets served, it is a fraction of the size of the JSON
+    with open(path, 'rb') as src, gzip.open(f"{path}.gz", 'wb') as dst:
+        shutil.copyfileobj(src, dst, 65535)
+    return f"{path}.gz"
+
+
+class CurseForgeDB:
+    """Read-only view over the indexed CurseForge DB. Records are only loaded when looked up."""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True)
+        self.db.execute("PRAGMA mmap_size = 268435456")
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM mods").fetchone()[0]
+
+    def get_by_slug(self, slug):
+        row = self.db.execute("SELECT * FROM mods WHERE slug = ? LIMIT 1", (slug,)).fetchone()
+        return row and from_row(row)
+
+    def get_by_id(self, mod_id):
+        row = self.db.execute("SELECT * FROM mods WHERE id = ?", (mod_id,)).fetchone()
+        return row and from_row(row)
+
+    def close(self):
+        self.db.close()
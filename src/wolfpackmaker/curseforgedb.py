@@ -1,8 +1,15 @@
 import aiohttp
 import argparse
 import asyncio
+import datetime
 import json
+import os
+import shutil
+import sys
+from dateutil.parser import isoparse
 from rich.traceback import install as init_traceback
+from cfdb import compress_db, merge_db, read_meta, read_mods, write_db, write_meta
+from httpclient import HttpClient
 from util import Log
 
 
@@ -18,6 +25,10 @@ def init_args():
     parser.add_argument('--with-figlet', help='Defaults to True. Use Figlet when printing the wolfpackmaker intro')
     parser.add_argument("-v", "--verbose", action="store_true",
                             help="increase output verbosity")
+    parser.add_argument("-j", "--jobs", type=int, default=8,
+                            help="amount of CurseForge API requests to run at once (default: 8)")
+    parser.add_argument("-i", "--incremental", action="store_true",
+                            help="only crawl mods updated since the last snapshot and merge them into curseforge.db")
     return parser
 
 
@@ -27,13 +38,23 @@ args = parse_args(parser)
 headers = {'User-Agent':'wolfpackmaker (made by Kalka) business inquiries: b@kalka.io'}
 
 
-async def get_curseforge_api(session, index, page_size, log, version=None):
-    curseforge_url = f'https://addons-ecs.forgesvc.net/api/v2/addon/search?categoryId=0&gameId=432{version and "&gameVersion=" + str(version)}&sectionId=6&searchFilter=&sort=0'
-    async with session.get(curseforge_url + '&pageSize={}&index={}'.format(page_size, index)) as r:
-        data = await r.json()
-        log.debug("Requested CurseForge API starting from index {}{}.".format(index,
-                                                                                 version and ' for version ' + version or ''))
-        return data
+SORT_FEATURED = 0
+SORT_LAST_UPDATED = 2
+
+checkpoint_path = 'curseforge.checkpoint.json'
+staging_path = 'curseforge.db.staging'
+
+
+async def get_curseforge_api(session, index, page_size, log, version=None, sort=SORT_FEATURED):
+    curseforge_url = f'https://addons-ecs.forgesvc.net/api/v2/addon/search?categoryId=0&gameId=432{version and "&gameVersion=" + str(version) or ""}&sectionId=6&searchFilter=&sort={sort}{sort == SORT_LAST_UPDATED and "&sortOrder=desc" or ""}'
+    try:
+        data = await session.get_json(curseforge_url + '&pageSize={}&index={}'.format(page_size, index))
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        log.warning(f"Index {index}{version and ' for version ' + version or ''} failed ({e!r}).")
+        return None
+    log.debug("Requested CurseForge API starting from index {}{}.".format(index,
+                                                                             version and ' for version ' + version or ''))
+    return data
 
 versions = [
     "1.16.5",
@@ -46,40 +67,128 @@ versions = [
     "1.7.10"
 ]
 
+page_size = 50
+max_pages = 200  # CurseForge does not serve anything past index 10000
+
+
+def to_mod(m):
+    return {
+        "id": m.get("id"),
+        "name": m.get("name"),
+        "summary": m.get("summary"),
+        "slug": m.get("slug"),
+        "latest_files": m.get("gameVersionLatestFiles") or m.get("latest_files") or m.get("latestFiles")
+    }
+
+
+def load_checkpoint(log, since):
+    try:
+        with open(checkpoint_path, 'r') as f:
+            checkpoint = json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        checkpoint = None
+    if checkpoint and checkpoint['since'] == since and os.path.exists(staging_path):
+        log.info(f"Resuming the crawl started at {checkpoint['started']} from {checkpoint_path}.")
+        return checkpoint
+    if os.path.exists(staging_path):
+        os.remove(staging_path)
+    write_db([], staging_path)
+    return {
+        "started": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "since": since,
+        "streams": {}
+    }
+
+
+def save_checkpoint(checkpoint):
+    with open(f"{checkpoint_path}.tmp", 'w') as f:
+        f.write(json.dumps(checkpoint))
+    os.replace(f"{checkpoint_path}.tmp", checkpoint_path)
+
+
+def is_complete(checkpoint):
+    return all(s['done'] for s in checkpoint['streams'].values())
+
+
+async def crawl_version(session, slots, log, checkpoint, version=None):
+    # Workers claim page indexes in order and the stream stops at the first empty or short page,
+    # or in incremental mode, at the first page reaching mods older than the last snapshot.
+    # Every page goes to the staging DB and the checkpoint records how far the stream got.
+    state = checkpoint['streams'].setdefault(version or 'all', {'next_index': 0, 'done': False})
+    if state['done']:
+        return
+    since = checkpoint['since'] and isoparse(checkpoint['since'])
+    sort = since and SORT_LAST_UPDATED or SORT_FEATURED
+    next_index = [state['next_index']]
+    fetched = set()
+    stop_index = [max_pages * page_size]  # first page the stream ends on, pages below it are always fetched
+    pages = [0]
+    failed = []
+
+    async def worker():
+        while next_index[0] < stop_index[0]:
+            index = next_index[0]
+            next_index[0] += page_size
+            async with slots:
+                if index > stop_index[0]:
+                    return
+                data = await get_curseforge_api(session, index, page_size, log, version=version, sort=sort)
+            if data is None:
+                log.warning(f"Skipping index {index}{version and ' for version ' + version or ''}, it will be retried on resume.")
+                failed.append(index)
+                continue
+            write_db([to_mod(m) for m in data], staging_path)
+            pages[0] += 1
+            fetched.add(index)
+            while state['next_index'] in fetched:
+                fetched.remove(state['next_index'])
+                state['next_index'] += page_size
+            save_checkpoint(checkpoint)
+            if len(data) < page_size or (since and any(m.get('dateModified') and isoparse(m['dateModified']) < since for m in data)):
+                stop_index[0] = min(stop_index[0], index)
+
+    await asyncio.gather(*[worker() for _ in range(args.jobs)])
+    # next_index never moves past a failed page, so a resume starts from the first gap
+    state['done'] = not [index for index in failed if index < stop_index[0]]
+    save_checkpoint(checkpoint)
+    log.info(f"Crawled {pages[0]} pages{version and ' for version ' + version or ''}"
+             f"{failed and f', {len(failed)} failed' or ''}.")
+
 
 async def process_curseforge_db(log):
     assert isinstance(log, Log)
-    index = 0
-    page_size = 50
-    session = aiohttp.ClientSession()
-    workers = []
-    mods = []
-    for i in range(200):
-        workers.append(asyncio.create_task(get_curseforge_api(session, index, page_size, log)))
-        index += page_size
-    for v in versions:
-        index = 0
-        page_size = 50
-        for i in range(200):
-            workers.append(asyncio.create_task(get_curseforge_api(session, index, page_size, log, version=v)))
-            index += page_size
-    future = asyncio.gather(*workers)
-    for d in await future:
-        for m in d:
-            if m['id'] in [v['id'] for v in mods]:
-                continue
-            mods.append({
-                "id": m.get("id"),
-                "name": m.get("name"),
-                "summary": m.get("summary"),
-                "slug": m.get("slug"),
-                "latest_files": m.get("gameVersionLatestFiles") or m.get("latest_files") or m.get("latestFiles")
-            })
+    since = None
+    if args.incremental:
+        since = os.path.exists('curseforge.db') and read_meta('curseforge.db', 'snapshot')
+        if since:
+            log.info(f"Crawling mods updated since {since}...")
+        else:
+            log.warning("No previous snapshot in curseforge.db, crawling everything.")
+            since = None
+    checkpoint = load_checkpoint(log, since)
+    slots = asyncio.Semaphore(args.jobs)
+    async with HttpClient(log, headers=headers, limit=args.jobs, limit_per_host=args.jobs) as session:
+        await asyncio.gather(*[crawl_version(session, slots, log, checkpoint, version=v) for v in [None] + versions])
+    if not is_complete(checkpoint):
+        # curseforge.db stays as it was, the checkpoint and staging DB are kept for the next run to resume.
+        # The snapshot must not move past a missing page either, or no later incremental run would fetch it.
+        log.critical("Some pages could not be fetched, run again to resume. curseforge.db was not updated.")
+        sys.exit(1)
+    log.debug("Saving indexed mod data...")
+    if since:
+        log.info(f"{len(read_mods(staging_path))} mods changed since the last snapshot.")
+        shutil.copy('curseforge.db', staging_path + '.merged')
+        merge_db(staging_path, staging_path + '.merged')
+        os.replace(staging_path + '.merged', staging_path)
+    write_meta(staging_path, 'snapshot', checkpoint['started'])
+    os.replace(staging_path, 'curseforge.db')
+    mods = read_mods('curseforge.db')
     log.info(f"{len(mods)} mods.")
-    await session.close()
     with open('curseforge.json', 'w') as f:
         log.debug("Saving mod data...")
-        f.write(json.dumps(mods, indent=2))
+        f.write(json.dumps(mods))
+    log.info(f"Saved {compress_db('curseforge.db')}.")
+    os.remove(checkpoint_path)
 
 
 def main():
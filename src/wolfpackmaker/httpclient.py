@@ -0,0 +1,123 @@
+import aiohttp
+import asyncio
+import random
+
+from collections import Counter
+from contextlib import asynccontextmanager
+
+try:
+    import aiodns  # noqa: F401 aiohttp's AsyncResolver needs it
+    Resolver = aiohttp.AsyncResolver
+except ImportError:
+    Resolver = aiohttp.ThreadedResolver
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_ERRORS = (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)
+
+
+class RetryableStatus(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.retry_after = retry_after
+
+
+class HttpClient:
+    """Shared aiohttp session for the wolfpackmaker scripts.
+
+    Keeps connections alive in one pool, caps connections per host, caches DNS lookups (through aiodns when
+    it is installed) and retries connection errors, timeouts and 429/5xx responses with exponential backoff
+    and full jitter. get/head/post can be used like the ClientSession methods of the same name.
+    """
+
+    def __init__(self, log=None, headers=None, limit=64, limit_per_host=8, connect_timeout=10, read_timeout=30,
+                 retries=5, backoff=0.5, max_backoff=30):
+        self.log = log
+        self.headers = headers
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = Counter()
+        self._session = None
+
+    @property
+    def session(self):
+        # Created on first use, the resolver has to be made inside the running event loop
+        if self._session is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=300,
+                keepalive_timeout=30,
+                resolver=Resolver()
+            )
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.headers, timeout=self.timeout)
+        return self._session
+
+    def get_delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def with_retries(self, url, attempt_fn):
+        for attempt in range(self.retries + 1):
+            self.stats['requests'] += 1
+            try:
+                return await attempt_fn(attempt == self.retries)
+            except (RetryableStatus, *RETRY_ERRORS) as e:
+                if attempt == self.retries:
+                    self.stats['failures'] += 1
+                    raise
+                self.stats['retries'] += 1
+                delay = self.get_delay(attempt, getattr(e, 'retry_after', None))
+                self.log and self.log.debug(f"{url} failed ({e!r}), retrying in {delay:.1f}s ({attempt + 1} of {self.retries})...")
+                await asyncio.sleep(delay)
+
+    async def send(self, method, url, final=False, **kwargs):
+        r = await self.session.request(method, url, **kwargs)
+        if r.status in RETRY_STATUSES and not final:
+            retry_after = r.headers.get('retry-after', '')
+            r.release()
+            raise RetryableStatus(r.status, retry_after.isdigit() and int(retry_after) or None)
+        return r
+
+    @asynccontextmanager
+    async def request(self, method, url, **kwargs):
+        # Retries until a response starts, errors while streaming the body are left to the caller.
+        # Once out of retries, a 429/5xx response is handed over as is.
+        r = await self.with_retries(url, lambda final: self.send(method, url, final, **kwargs))
+        try:
+            yield r
+        finally:
+            r.release()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    async def get_json(self, url, **kwargs):
+        async def attempt(final):
+            async with await self.send('GET', url, final, **kwargs) as r:
+                r.raise_for_status()
+                return await r.json()
+        return await self.with_retries(url, attempt)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+        self.log and self.log.debug(
+            f"HTTP: {self.stats['requests']} requests, {self.stats['retries']} retries, {self.stats['failures']} failures.")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -14,6 +14,8 @@ class Installer:
                                                 '--repo Odin, from https://git.kalka.io/Wolfpack/Odin')
         self.parser.add_argument("-v", "--verbose", action="store_true",
                             help="increase output verbosity")
+        self.parser.add_argument("--log-json", action="store_true",
+                            help="write the logfile as JSON lines")
         self.args = self.parser.parse_args()
         self.session = Session()
         self.c = Log()
@@ -28,7 +30,7 @@ class Installer:
 
 def main():
     i = Installer()
-    i.c.parse_log(i.args)
+    i.c.parse_log(i.args, "installer")
     i.c.fancy_intro(i.parser.description)
     i.server_install()
     i.c.save_log("installer")
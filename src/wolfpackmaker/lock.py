@@ -4,27 +4,47 @@ import aiohttp
 import argparse
 import asyncio
 import datetime
+import hashlib
 import json
 import logging
 import sys
 import time
 import yaml
+import zlib
 
 
 from aiohttp.client_exceptions import ContentTypeError
+from appdirs import user_cache_dir
 from collections import Counter
 from os.path import basename
+from pathlib import Path
 from rich.traceback import install as init_traceback
+from apicache import ApiCache
+from cfdb import CurseForgeDB, write_db
+from httpclient import HttpClient
 from util import Log
 
 TYPE_FABRIC = 4
 TYPE_FORGE = 1
 
+HASH_ALGOS = {1: 'sha1', 2: 'md5'}  # CurseForge file hash algorithm ids
+REQUIRED_DEPENDENCY = 3
+
 
 log = Log()
+api_cache = ApiCache()
 
 found_mods = []
-mod_slugs = []
+found_mods_by_slug = {}  # slug -> entry in found_mods
+found_mods_by_id = {}  # CurseForge id -> entry in found_mods, doubles as the set of resolved ids
+mod_slugs = set()
+
+
+def add_found_mod(mod):
+    found_mods.append(mod)
+    found_mods_by_slug[mod['slug']] = mod
+    if mod['id'] is not None:
+        found_mods_by_id[mod['id']] = mod
 
 
 def parse_args(parser):
@@ -37,62 +57,125 @@ def init_args():
         description='Wolfpackmaker (lock.py) (https://woofmc.xyz)'
     )
     parser.add_argument('-v', '--verbose', help='Increase output verbosity.', action='store_true')
+    parser.add_argument('--log-json', help='Write the logfile as JSON lines.', action='store_true')
     parser.add_argument('-m', '--manifest', help='Optional location for the manifest e.g /opt/manifests/manifest.yml.'
                                                  '\nDefaults to workdir (manifest.yml)')
+    parser.add_argument('--full', help='Ignore the existing manifest.lock and resolve every mod again.', action='store_true')
+    parser.add_argument('--offline', help='Use the cached CurseForge DB without checking for a newer one.', action='store_true')
     parser.add_argument('--with-figlet', help='Defaults to True. Use Figlet when printing the wolfpackmaker intro')
     return parser
 
-timeout = aiohttp.ClientTimeout(total=1)
-retries = 5
-
 async def fetch_file(curseforge_url, mod, session, fileId):
     files_url = f"{curseforge_url}{mod['id']}/file/{fileId}"
-    for i in range(retries):
-        try:
-            async with session.get(files_url, timeout=timeout) as r:
-                try:
-                    file = await r.json()
-                except ContentTypeError:
-                    log.error(mod)
-                    sys.exit(log.error("ContentType error."))
-            break
-        except asyncio.TimeoutError:
-            log.info(f"Retrying {mod['name']} ({i+1} of {retries})...")
-            continue
+    file = api_cache.get_json(files_url)
+    if file is not None:
+        return file
+    try:
+        file = await session.get_json(files_url)
+    except ContentTypeError:
+        log.error(mod)
+        sys.exit(log.error("ContentType error."))
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        sys.exit(log.critical(f"Could not get file {fileId} of {mod['name']} ({e!r})."))
+    api_cache.set_json(files_url, file)
     return file
 
 
+def get_file_hashes(file):
+    return {HASH_ALGOS[h['algo']]: h['value'] for h in file.get('hashes') or [] if h.get('algo') in HASH_ALGOS}
+
+
+async def probe_content_length(url, session):
+    # HEAD first, then a single byte range, without ever reading the body
+    headers = {'Accept-Encoding': 'identity'}
+    try:
+        async with session.head(url, headers=headers, allow_redirects=True) as r:
+            if r.status == 200 and r.headers.get('content-length'):
+                return int(r.headers['content-length'])
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        pass
+    async with session.get(url, headers={**headers, 'Range': 'bytes=0-0'}) as r:
+        r.raise_for_status()
+        if r.status == 206:
+            total = r.headers.get('content-range', '').rpartition('/')[2]  # e.g "bytes 0-0/3995456"
+            if total.isdigit():
+                return int(total)
+        elif r.status == 200 and r.headers.get('content-length'):
+            return int(r.headers['content-length'])
+    return None
+
+
+async def download_to_cache(url, session, filename):
+    # Last resort, so keep the bytes where the client looks for cached mods
+    path = Path(user_cache_dir('wolfpackmaker')) / 'mods' / filename
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{filename}.tmp")
+    content_length = 0
+    sha1 = hashlib.sha1()
+    try:
+        async with session.get(url) as r:
+            r.raise_for_status()
+            with open(tmp_path, 'wb') as f:
+                async for chunk in r.content.iter_chunked(65535):
+                    f.write(chunk)
+                    content_length += len(chunk)
+                    sha1.update(chunk)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    os.replace(tmp_path, path)
+    log.info(f"Saved {filename} ({content_length} bytes) to {path.parent}")
+    return content_length, {'sha1': sha1.hexdigest()}
+
+
 async def set_content_length(curseforge_url, session, mod_slug):
-    async with session.get(curseforge_url) as r:
-        content_length = int()
-        try:
-            content_length = int(r.headers['content-length'])
-        except KeyError:
+    m = found_mods_by_slug[mod_slug]
+    hashes = {}
+    try:
+        content_length = await probe_content_length(curseforge_url, session)
+        if content_length is None:
             log.warning("Could not get Content-Length directly, getting it ourselves...")
-            async for chunk in r.content.iter_any():
-                content_length += len(chunk)
-            log.info(content_length)
+            content_length, hashes = await download_to_cache(curseforge_url, session, m['filename'])
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # Locking an error page's length and hash would make clients install it as the mod
+        sys.exit(log.critical(f"Could not get {m['name']} from {curseforge_url} ({e!r})."))
+    log.info(f"Appended file length to {m['name']}")
+    m.update({"fileLength": content_length})
+    hashes and m.update({"hashes": hashes})
 
-    for m in found_mods:
-        if mod_slug == m['slug']:
-            log.info(f"Appended file length to {m['name']}")
-            m.update({"fileLength": content_length})
+
+async def reuse_content_length(locked):
+    m = found_mods_by_slug[locked['slug']]
+    m.update({"fileLength": locked['fileLength']})
+    locked.get('hashes') and m.update({"hashes": locked['hashes']})
+
+
+async def set_file_hash(session, mod):
+    sha1 = hashlib.sha1()
+    try:
+        async with session.get(mod['downloadUrl']) as r:
+            r.raise_for_status()
+            async for chunk in r.content.iter_chunked(65535):
+                sha1.update(chunk)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # Without a hash the client still checks the size
+        return log.warning(f"Could not compute sha1 for {mod['name']} ({e!r}), leaving it unhashed.")
+    mod.update({"hashes": {"sha1": sha1.hexdigest()}})
+    log.info(f"Computed sha1 for {mod['name']}")
 
 
 async def fetch_mod(curseforge_url, mod_id, session):
     mod_url = curseforge_url + str(mod_id)
-    for i in range(retries):
-        try:
-            async with session.get(mod_url, timeout=timeout) as r:
-                # log.debug("Responding to request {}...".format(mod_url))
-                try:
-                    mod = await r.json()
-                except ContentTypeError:
-                    sys.exit(log.error("ContentType error."))
-            break
-        except asyncio.TimeoutError:
-            log.info(f"Retrying {mod_id['name']}...")
-            continue
+    mod = api_cache.get_json(mod_url)
+    if mod is not None:
+        return mod
+    try:
+        mod = await session.get_json(mod_url)
+    except ContentTypeError:
+        sys.exit(log.error("ContentType error."))
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        sys.exit(log.critical(f"Could not get mod {mod_id} ({e!r})."))
+    api_cache.set_json(mod_url, mod)
     return mod
 
 
@@ -101,84 +184,237 @@ modloader = ''
 import datetime
 
 
-async def get_mod_file(curseforge_url, modpack_manifest, version, mc_version, mod, session, is_file_found):
-    if is_file_found:
-        return
+def is_compatible(modpack_manifest, version, mc_version):
     try:
         mod_compat = version["modLoader"]
     except KeyError:
         mod_compat = None
-    
+
     if modpack_manifest["modloader"].lower() == 'forge' and mod_compat == TYPE_FABRIC:
-        return
+        return False
     if modpack_manifest["modloader"].lower() == 'fabric' and mod_compat == TYPE_FORGE:
+        return False
+    return version["gameVersion"] in mc_version
+
+
+def pick_file_id(modpack_manifest, latest_files, mc_version):
+    # The file get_mod_file would pick, known without any request
+    for version in latest_files:
+        if is_compatible(modpack_manifest, version, mc_version):
+            return version["projectFileId"]
+
+
+async def get_mod_file(curseforge_url, modpack_manifest, version, mc_version, mod, session, is_file_found):
+    if is_file_found:
         return
-    if version["gameVersion"] in mc_version:
+    if is_compatible(modpack_manifest, version, mc_version):
         file_id = version["projectFileId"]
         file = await fetch_file(curseforge_url, mod, session, file_id)
         return file
 
 
-async def fetch_mod_data(curseforge_url, mod, session, modpack_manifest, cf_data, completed, to_complete):
-    start_time = time.time()
-    mc_version = [modpack_manifest["version"]]
-    # if "1.16.5" in mc_version:
-    #     for i in range(1, 5):
-    #         mc_version.append(f"1.16.{i}")
-    file_found = False
+def get_latest_files(mod):
+    return mod.get('latest_files') or mod.get('gameVersionLatestFiles') or mod.get('latestFiles') or []
+
+
+def get_lock_fields(file):
+    return {
+        "downloadUrl": file["downloadUrl"],
+        "filename": file["fileName"],
+        "fileLength": file["fileLength"],
+        "hashes": get_file_hashes(file),
+        "fileId": file["id"],
+        "dependencies": [d["addonId"] for d in file.get("dependencies") or [] if d["type"] == REQUIRED_DEPENDENCY]
+    }
+
+
+def file_from_lock_entry(entry):
+    # Inverse of get_lock_fields, enough for DependencyResolver to walk the dependencies again
+    algos = {v: k for k, v in HASH_ALGOS.items()}
+    return {
+        "id": entry["fileId"],
+        "downloadUrl": entry["downloadUrl"],
+        "fileName": entry["filename"],
+        "fileLength": entry["fileLength"],
+        "hashes": [{"algo": algos[k], "value": v} for k, v in (entry.get("hashes") or {}).items() if k in algos],
+        "dependencies": [{"addonId": d, "type": REQUIRED_DEPENDENCY} for d in entry.get("dependencies") or []]
+    }
+
+
+class DependencyResolver:
+    """Resolves the files of the manifest mods and of their whole tree of required dependencies.
+
+    The tree is expanded one level (wave) at a time, with the files of a wave fetched concurrently.
+    Every addon is resolved exactly once and dependencies come out in a deterministic order.
+    """
+
+    def __init__(self, curseforge_url, session, modpack_manifest, curseforge_db, previous=None):
+        self.curseforge_url = curseforge_url
+        self.previous = previous or {}  # addon id -> entry of the previous manifest.lock
+        self.session = session
+        self.modpack_manifest = modpack_manifest
+        self.curseforge_db = curseforge_db
+        self.mc_version = [modpack_manifest["version"]]
+        self.files = {}  # addon id -> file, None when there is no file for mc_version
+        self.dependencies = []  # addons pulled in as dependencies, in resolution order
+        self.seen_ids = set()
+        self.seen_slugs = set()
+        self.completed = 0
+        self.to_complete = 0
+        self.reused = 0
+
+    async def resolve_file(self, mod):
+        start_time = time.time()
+        locked = self.previous.get(mod['id'])
+        if locked and locked.get('fileId') is not None and \
+                locked['fileId'] == pick_file_id(self.modpack_manifest, get_latest_files(mod), self.mc_version):
+            self.completed += 1
+            self.reused += 1
+            log.debug(f"[LOCK] [{self.completed}/{self.to_complete}] {mod['name']} is unchanged.")
+            return file_from_lock_entry(locked)
+        file = None
+        for version in get_latest_files(mod):
+            file = await get_mod_file(self.curseforge_url, self.modpack_manifest, version, self.mc_version, mod, self.session, False)
+            if file:
+                break
+        self.completed += 1
+        log.info(f"[LOCK] [{self.completed}/{self.to_complete}] {mod['name']} took {time.time() - start_time:.3f} seconds.")
+        if not file:
+            log.warning(
+                f"Mod {mod['slug']} [{mod['name']}] does not have an apparent version for {self.mc_version}, tread with caution")
+        return file
+
+    async def resolve(self, mods, skip_slugs=()):
+        self.seen_ids.update(m['id'] for m in mods)
+        self.seen_slugs.update(skip_slugs)
+        wave = list(mods)
+        level = 0
+        while wave:
+            self.to_complete += len(wave)
+            log.debug(f"Resolving {len(wave)} mods at dependency level {level}...")
+            files = await asyncio.gather(*[self.resolve_file(m) for m in wave])
+            next_wave = []
+            for mod, file in zip(wave, files):
+                self.files[mod['id']] = file
+                for dep in file and file["dependencies"] or []:
+                    if dep["type"] != REQUIRED_DEPENDENCY or dep["addonId"] in self.seen_ids:
+                        continue
+                    self.seen_ids.add(dep["addonId"])
+                    d = self.curseforge_db.get_by_id(dep["addonId"])
+                    if d is None:
+                        log.warning(f"Dependency {dep['addonId']} of {mod['name']} is not in the CurseForge DB, skipping it.")
+                        continue
+                    if d['slug'] in self.seen_slugs:
+                        continue
+                    self.seen_slugs.add(d['slug'])
+                    log.info(f"Resolving dependency {d['name']} for mod {mod['name']}...")
+                    self.dependencies.append(d)
+                    next_wave.append(d)
+            wave = next_wave
+            level += 1
 
-    try:
-        latest_files = mod['latest_files']
-    except KeyError:
-        try:
-            latest_files = mod['gameVersionLatestFiles']
-        except KeyError:
-            log.info(mod)
-            latest_files = mod['latestFiles']
-    
-    for version in latest_files:
-            file = await get_mod_file(curseforge_url, modpack_manifest, version, mc_version, mod, session, file_found)
-            if not file: continue
-            file_found = True
-            deps = []
-            for dep in file["dependencies"]:
-                if dep["addonId"] in [m["id"] for m in found_mods]:
-                    break
-                deps += [d for d in cf_data if dep["addonId"] == d["id"] and dep["type"] == 3]
-            dep_file_found = False
-            for d in deps:
-                if d['slug'] in [m for m in mod_slugs]:
-                    break
-                log.info(f"Resolving dependency {d['name']} for mod {mod['name']}...")
-                mod_slugs.append(d['slug'])
-                for df in d["latest_files"]:
-                    dep_file = await get_mod_file(curseforge_url, modpack_manifest, df, mc_version, d, session, dep_file_found)
-                    if not dep_file: continue
-                    dep_file_found = True
-                    found_mods.append({
-                        "id": d["id"],
-                        "slug": d["slug"],
-                        "name": d["name"],
-                        "downloadUrl": dep_file["downloadUrl"],
-                        "filename": dep_file["fileName"],
-                        "fileLength": dep_file["fileLength"]
-                    })
-            for m in found_mods:
-                if m.get('downloadUrl') is not None:
-                    continue
-                if m["id"] == mod["id"]:
-                    m.update({'downloadUrl': file['downloadUrl'], 'filename': file['fileName'], 'fileLength': file['fileLength']})
-    completed[0] += 1
-    log.info(f"[LOCK] [{completed[0]}/{to_complete[0]}] {mod['name']} took {time.time() - start_time:.3f} seconds.")
-    if not file_found:
-        log.warning(
-            f"Mod {mod['slug']} [{mod['name']}] does not have an apparent version for {mc_version}, tread with caution")
 
 minecraft_version = []
+lock_info = {}  # written to manifest.lock, so the next run can tell what changed
+
+
+curseforge_db_url = "https://vulpera.com/curseforge.db.gz"
+curseforge_download_url = "https://vulpera.com/curseforge.json"
+curseforge_db_path = Path(user_cache_dir('wolfpackmaker')) / 'curseforge.db'
+curseforge_db_info_path = curseforge_db_path.with_suffix('.db.json')
+
+
+def log_db_date(last_modified):
+    if last_modified is None:
+        return
+    date = datetime.datetime.strptime(last_modified, "%a, %d %b %Y %H:%M:%S %Z")
+    log.info(f"CurseForge DB date is {datetime.datetime.strftime(date, '%B %d, %Y at %H:%M:%Sz')}")
+
 
-async def process_modpack_config(manifest):
-    chunked = True  # Should chunk
+def read_db_info():
+    try:
+        return json.loads(curseforge_db_info_path.read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_db_info(url, headers):
+    curseforge_db_info_path.write_text(json.dumps({
+        "url": url,
+        "etag": headers.get("etag"),
+        "last_modified": headers.get("last-modified")
+    }))
+
+
+def get_conditional_headers(db_info, url):
+    headers = {}
+    if db_info.get("url") != url or not curseforge_db_path.exists():
+        return headers
+    if db_info.get("etag"):
+        headers["If-None-Match"] = db_info["etag"]
+    if db_info.get("last_modified"):
+        headers["If-Modified-Since"] = db_info["last_modified"]
+    return headers
+
+
+async def save_curseforge_db(r):
+    # Decompress while streaming, SQLite needs a real file to open
+    tmp_path = curseforge_db_path.with_suffix('.db.tmp')
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    with open(tmp_path, 'wb') as f:
+        async for c in r.content.iter_chunked(65535):
+            f.write(decompressor.decompress(c))
+        f.write(decompressor.flush())
+    os.replace(tmp_path, curseforge_db_path)
+
+
+async def save_curseforge_json(r):
+    log.info("Reading chunked data... (it's probably big)")
+    data = io.BytesIO()
+    async for c in r.content.iter_chunked(65535):
+        data.write(c)
+    data.seek(0)
+    tmp_path = curseforge_db_path.with_suffix('.db.tmp')
+    tmp_path.unlink(missing_ok=True)
+    write_db(json.loads(data.read()), tmp_path)
+    os.replace(tmp_path, curseforge_db_path)
+
+
+async def load_curseforge_db(session, offline=False):
+    db_info = read_db_info()
+    if offline:
+        if not curseforge_db_path.exists():
+            sys.exit(log.critical(f"No cached CurseForge DB in {curseforge_db_path}. Run once without --offline first."))
+        log.info(f"Offline mode, using cached CurseForge DB {curseforge_db_path}")
+        log_db_date(db_info.get("last_modified"))
+        return CurseForgeDB(curseforge_db_path)
+    curseforge_db_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        # The compressed, indexed DB first, the plain JSON as a fallback
+        for url, save in ((curseforge_db_url, save_curseforge_db), (curseforge_download_url, save_curseforge_json)):
+            log.info(f"Reading CurseForge data from {url}")
+            async with session.get(url, headers=get_conditional_headers(db_info, url)) as r:
+                if r.status == 304:
+                    log.info("CurseForge DB has not changed, using the cached copy.")
+                    log_db_date(db_info.get("last_modified"))
+                    return CurseForgeDB(curseforge_db_path)
+                if r.status == 200:
+                    log_db_date(r.headers.get("last-modified"))
+                    await save(r)
+                    save_db_info(url, r.headers)
+                    return CurseForgeDB(curseforge_db_path)
+                log.warning(f"{url} returned {r.status}.")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        log.warning(f"Could not reach the CurseForge DB ({e!r}).")
+    if curseforge_db_path.exists():
+        log.warning("Using the cached CurseForge DB, it might be out of date.")
+        return CurseForgeDB(curseforge_db_path)
+    sys.exit(log.critical("Could not get the CurseForge DB."))
+
+
+async def process_modpack_config(manifest, offline=False, previous_lock=None):
     curseforge_url = 'https://addons-ecs.forgesvc.net/api/v2/addon/'
+    lock_info["manifest_sha1"] = hashlib.sha1(manifest.encode()).hexdigest()
     modpack_manifest = yaml.load(manifest, Loader=yaml.SafeLoader)
     minecraft_version.append(modpack_manifest["version"])
     mods = modpack_manifest["mods"]
@@ -186,30 +422,28 @@ async def process_modpack_config(manifest):
     duplicate_mods = []
     for idx, mod in enumerate(mods):
         for k, v in mods[idx].items():
-            mod_slugs.append(k)
+            mod_slugs.add(k)
             duplicate_mods.append(k)
     if [k for k,v in Counter(duplicate_mods).items() if v>1]:
         sys.exit(log.critical(f"Found duplicates in the manifest file. Please remove them before continuing:\n> {[k for k,v in Counter(duplicate_mods).items() if v>1]}"))
-    curseforge_download_url = "https://vulpera.com/curseforge.json"
-    session = aiohttp.ClientSession()
+    session = HttpClient(log)
     log.debug(f"Established session {session}")
-    log.info(f"Reading CurseForge data from {curseforge_download_url}")
     start_time = time.time()
-    async with session.get(curseforge_download_url) as r:
-        date = datetime.datetime.strptime(r.headers["last-modified"], "%a, %d %b %Y %H:%M:%S %Z")
-        log.info(f"CurseForge DB date is {datetime.datetime.strftime(date, '%B %d, %Y at %H:%M:%Sz')}")
-        if chunked:
-            log.info("Reading chunked data... (it's probably big)")
-            data = io.BytesIO()
-            async for c in r.content.iter_chunked(65535):
-                data.write(c)
-            data.seek(0)
-            curseforge_data = json.loads(data.read())
-        else:
-            data = await r.read()
-            curseforge_data = json.loads(data)
-    log.info(f"Took {time.time() - start_time:.2f}s. {len(curseforge_data)} mods recognized.")
+    curseforge_db = await load_curseforge_db(session, offline)
+    log.info(f"Took {time.time() - start_time:.2f}s. {len(curseforge_db)} mods recognized.")
+    lock_info["db_date"] = read_db_info().get("last_modified")
+    previous_lock = previous_lock or {}
+    if previous_lock.get("manifest_sha1") == lock_info["manifest_sha1"] and previous_lock.get("db_date") == lock_info["db_date"]:
+        log.info("Neither the manifest nor the CurseForge DB changed since manifest.lock was saved, nothing to do.")
+        lock_info["unchanged"] = True
+        found_mods.extend(previous_lock["mods"])
+        await session.close()
+        curseforge_db.close()
+        return found_mods
+    previous_mods = {m["id"]: m for m in previous_lock.get("mods", []) if m.get("id") is not None and m.get("fileId") is not None}
+    previous_slugs = {m["slug"]: m for m in previous_lock.get("mods", [])}
     tasks = []
+    to_resolve = []  # CurseForge addons of the manifest, in manifest order
     to_complete = [0]
     completed = [0]
     for idx, mod in enumerate(mods):
@@ -225,9 +459,8 @@ async def process_modpack_config(manifest):
             not_found_msg = f'This happened because we exhausted all efforts to search for {k}, and the only info we know about it is the mod slug, which is just {k}. The easiest fix to this is to visit https://www.curseforge.com/minecraft/mc-mods/{k} and copy the value of "Project ID", and append it to the corresponding mod in the yaml manifest, e.g:\n- {k}:\n    id: <id>... \nThe script will continue and disregard this specific mod, but it will be considered a mod we cannot digest!'
             finished_suffix = " (took {:.2f} seconds)"
             start_time
-            try:
-                mod_data = [m for m in curseforge_data if k == m['slug']][0]
-            except IndexError:
+            mod_data = curseforge_db.get_by_slug(k)
+            if mod_data is None:
                 mod_data = [{
                     "id": None,
                     "name": k
@@ -241,12 +474,11 @@ async def process_modpack_config(manifest):
                     except KeyError:
                         to_complete[0] += 1
                         log.info(f"Using {id} for {k}. This should guarantee a positive match.")
-                        cf_get = await session.get(curseforge_url + str(id))
-                        data = await cf_get.json()
+                        data = await fetch_mod(curseforge_url, id, session)
                         if k != data['slug']:
                             sys.exit(log.critical(f"Mod mismatch! {k} =/= {data['slug']}. This is usually impossible unless you are using the wrong mod ID."))
                         log.info(f"[MATCH] [{completed[0]}/{to_complete[0]}] Resolved {data['name']} through CurseForge!")
-                        found_mods.append({
+                        add_found_mod({
                             "id": data['id'],
                             "slug": data['slug'],
                             "name": data['name'],
@@ -254,15 +486,18 @@ async def process_modpack_config(manifest):
                             "serveronly": server_only,
                             "optional": optional
                         })
-                        task = asyncio.create_task(fetch_mod_data(curseforge_url, data, session, modpack_manifest, curseforge_data, completed, to_complete))
-                        tasks.append(task)
+                        to_resolve.append(data)
                         has_id[0] = True
                 case {'url': url}:
-                    task = asyncio.create_task(set_content_length(url, session, k))
-                    tasks.append(task)
+                    locked = previous_slugs.get(k, {})
+                    if locked.get('downloadUrl') == url and locked.get('fileLength') is not None:
+                        # Same URL as last time, keep the measured length and hash
+                        tasks.append(asyncio.create_task(reuse_content_length(locked)))
+                    else:
+                        tasks.append(asyncio.create_task(set_content_length(url, session, k)))
                     if url.split('.')[-1] == 'zip':
                         log.info(f"Handling resourcepack {k}...")
-                        found_mods.append({
+                        add_found_mod({
                             "id": mod_data['id'] or None,
                             "name": k,
                             "slug": k,
@@ -271,7 +506,7 @@ async def process_modpack_config(manifest):
                             "resourcepack": True
                         })
                         continue
-                    found_mods.append({
+                    add_found_mod({
                         "id": mod_data['id'] or None,
                         "name": mod_data['name'] or k,
                         "slug": k,
@@ -290,8 +525,12 @@ async def process_modpack_config(manifest):
             if has_id[0]: continue
             if custom[0]: continue
             to_complete[0] += 1
-            log.info(f"[MATCH] [{completed[0]}/{to_complete[0]}] Resolved {mod_data['name']} {finished_suffix.format(time.time() - start_time)}!")
-            found_mods.append({
+            if mod_data['id'] is None:
+                log.warning(not_found_msg)
+            else:
+                log.info(f"[MATCH] [{completed[0]}/{to_complete[0]}] Resolved {mod_data['name']} {finished_suffix.format(time.time() - start_time)}!")
+                to_resolve.append(mod_data)
+            add_found_mod({
                 "id": mod_data['id'] or None,
                 "name": mod_data['name'] or k,
                 "slug": k,
@@ -299,20 +538,56 @@ async def process_modpack_config(manifest):
                 "serveronly": server_only,
                 "optional": optional
             })
-            task = asyncio.create_task(fetch_mod_data(curseforge_url, mod_data, session, modpack_manifest, curseforge_data, completed, to_complete))
-            tasks.append(task)
-    await asyncio.gather(*tasks)
+    resolver = DependencyResolver(curseforge_url, session, modpack_manifest, curseforge_db, previous_mods)
+    await asyncio.gather(resolver.resolve(to_resolve, skip_slugs=mod_slugs), *tasks)
+    for mod in to_resolve:
+        file = resolver.files[mod['id']]
+        m = found_mods_by_id[mod['id']]
+        if file and m.get('downloadUrl') is None:
+            m.update(get_lock_fields(file))
+    for d in resolver.dependencies:
+        dep_file = resolver.files[d['id']]
+        if not dep_file:
+            continue
+        add_found_mod({
+            "id": d["id"],
+            "slug": d["slug"],
+            "name": d["name"],
+            **get_lock_fields(dep_file)
+        })
+    if resolver.reused:
+        log.info(f"Reused {resolver.reused} unchanged mods from the previous manifest.lock.")
+    # Custom URLs are left alone, they can serve different content over time (e.g OptiFine)
+    unhashed = [m for m in found_mods if m.get('downloadUrl') and not m.get('custom') and not m.get('resourcepack') and not m.get('hashes')]
+    if unhashed:
+        log.info(f"CurseForge did not provide hashes for {len(unhashed)} files, computing them ourselves...")
+        await asyncio.gather(*[set_file_hash(session, m) for m in unhashed])
     await session.close()
+    curseforge_db.close()
     return found_mods
 
 
 def save_lockfile():
+    lock = {
+        "version": minecraft_version[0],
+        "manifest_sha1": lock_info.get("manifest_sha1"),
+        "db_date": lock_info.get("db_date"),
+        "mods": found_mods
+    }
     log.info("Saving lockfile...")
     with open('manifest.lock', 'w') as f:
-        f.write(json.dumps({"version": minecraft_version[0], "mods": found_mods}))
+        f.write(json.dumps(lock))
     log.info("Saving pretty-printed file...")
     with open('manifest.json', 'w') as f:
-        f.write(json.dumps({"version": minecraft_version[0], "mods": found_mods}, indent=2))
+        f.write(json.dumps(lock, indent=2))
+
+
+def read_previous_lockfile():
+    try:
+        with open('manifest.lock', 'r') as f:
+            return json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return None
 
 import requests
 
@@ -324,7 +599,7 @@ def main():
     init_traceback()
     parser = init_args()
     args = parse_args(parser)
-    log.parse_log(args)
+    log.parse_log(args, "lock")
     log.fancy_intro(parser.description)
     loop = asyncio.new_event_loop()
     if args.manifest:
@@ -336,9 +611,11 @@ def main():
         if os.path.exists('manifest.yml'):
             with open('manifest.yml') as f:
                 args.manifest = f.read()
-    task = loop.create_task(process_modpack_config(manifest=args.manifest))
+    previous_lock = not args.full and read_previous_lockfile() or None
+    task = loop.create_task(process_modpack_config(manifest=args.manifest, offline=args.offline, previous_lock=previous_lock))
     loop.run_until_complete(task)
-    save_lockfile()
+    if not lock_info.get("unchanged"):
+        save_lockfile()
     log.save_log("lock")
     sys.exit()
 
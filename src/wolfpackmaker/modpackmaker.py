@@ -1,6 +1,5 @@
 import asyncio
 import json
-import aiohttp
 import requests
 
 from rich import inspect
@@ -20,19 +19,16 @@ import argparse
 import io
 import os
 import random
-from simple_term_menu import TerminalMenu
-from bs4 import BeautifulSoup
 import sys
 import time
 import zipfile
 
+from apicache import ApiCache
+from httpclient import HttpClient
 from lock import process_modpack_config
 
 game_version = ['1.12.2']
 
-curseforge_url = 'https://addons-ecs.forgesvc.net/api/v2/addon/'
-modpack_search_url = f'{curseforge_url}search?gameId=432&categoryId=4472&searchFilter='
-
 def parse_args(parser):
     args = parser.parse_args()
     return args
@@ -43,35 +39,39 @@ def init_args():
         description='Wolfpackmaker (modpackmaker.py) (https://woofmc.xyz)'
     )
     parser.add_argument('modpack', metavar='MODPACK_SLUG', type=str, help='Search indication for a CurseForge modpack.')
+    parser.add_argument('--api-url', help='CurseForge API addon endpoint, e.g to point at a local fixture server.', default='https://addons-ecs.forgesvc.net/api/v2/addon/')
+    parser.add_argument('--no-lock', help='Stop after writing manifest.yml, without locking the mods.', action='store_true')
     return parser
 
 parser = init_args()
 args = parse_args(parser)
 
+curseforge_url = args.api_url
+modpack_search_url = f'{curseforge_url}search?gameId=432&categoryId=4472&searchFilter='
+
 headers = {
     'User-Agent': 'Wolfpackmaker (https://woofmc.xyz)',
     'Accept-Encoding': None
 }
 
-async def resolve_mod(session, file):
-    async with session.get(f"{curseforge_url}{file['projectID']}") as r:
-        data_mod = await r.json()
-    async with session.get(f"{curseforge_url}{file['projectID']}/file/{file['fileID']}") as r:
-        data_file = await r.json()
-    mod_yaml = f"- {data_mod['slug']}:\n"
-    mod_yaml += f"    url: {data_file['downloadUrl']}\n"
-    log.info(f"{data_mod['slug']}...")
-    return mod_yaml
+api_cache = ApiCache()
+
 
 async def resolve_mods(session, files):
-    tasks = []
-    async_session = aiohttp.ClientSession()
+    async with HttpClient(log, headers={'User-Agent': headers['User-Agent']}) as async_session:
+        addons = await api_cache.get_addons(async_session, curseforge_url, [f['projectID'] for f in files])
+        addon_files = await api_cache.get_files(async_session, curseforge_url, [(f['projectID'], f['fileID']) for f in files])
+    mods_yaml = ''
     for file in files:
-        task = asyncio.create_task(resolve_mod(async_session, file))
-        tasks.append(task)
-    future = await asyncio.gather(*tasks)
-    await async_session.close()
-    return ''.join(future)
+        data_mod = addons.get(file['projectID'])
+        data_file = addon_files.get(file['fileID'])
+        if data_mod is None or data_file is None:
+            log.warning(f"Could not resolve project {file['projectID']} (file {file['fileID']}), skipping it.")
+            continue
+        mods_yaml += f"- {data_mod['slug']}:\n"
+        mods_yaml += f"    url: {data_file['downloadUrl']}\n"
+        log.info(f"{data_mod['slug']}...")
+    return mods_yaml
 
 def main():
     session = requests.Session()
@@ -90,6 +90,7 @@ def main():
         result = json.loads(r.content)
         if len(result) > 1:
             log.info("Multiple modpack choices found. Select the modpack of choice below.")
+            from simple_term_menu import TerminalMenu
             terminal_menu = TerminalMenu([m['name'] for m in result])
             menu_entry_index = terminal_menu.show()
             selection = result[menu_entry_index]
@@ -100,6 +101,7 @@ def main():
     files = [f for f in selection['latestFiles']]
     if len(files) > 1:
         log.info(f"Multiple files for {selection['name']}. Choose which one you would like.")
+        from simple_term_menu import TerminalMenu
         terminal_menu = TerminalMenu([f['displayName'] + ' (released on ' + f['fileDate'] + ')' for f in files])
         menu_entry_index = terminal_menu.show()
         file_selection = files[menu_entry_index]
@@ -143,6 +145,7 @@ def main():
         optifine_url = "https://get.kalka.io/Optifine"
         log.info("Looking for OptiFine...")
         optifine_r = session.get(optifine_url)
+        from bs4 import BeautifulSoup
         optifine_html = BeautifulSoup(optifine_r.content)
         for href in optifine_html.find_all('a'):
             optifine_link = href.get('href')
@@ -154,6 +157,8 @@ def main():
     log.info(manifest_yaml)
     with open(f"{zip_dir}/manifest.yml", "w") as f:
         f.write(manifest_yaml)
+    if args.no_lock:
+        return log.info("Done, without locking.")
     log.info("Locking mods...")
     modpack_lock = asyncio.run(process_modpack_config(manifest=manifest_yaml))
     with open(f"{zip_dir}/manifest.lock", "w") as f:
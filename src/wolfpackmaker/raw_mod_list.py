@@ -1,5 +1,4 @@
 import argparse
-import aiohttp
 import asyncio
 import time
 import json
@@ -8,6 +7,8 @@ import sys
 
 from os import path
 
+from apicache import ApiCache
+from httpclient import HttpClient
 from util import Log
 
 
@@ -20,33 +21,11 @@ class ModList():
     mod_list = []
 
 
-    async def fetch(self, session, url):
-        try:
-            async with session.get(url) as r:
-                r = await r.read()
-        except aiohttp.ClientResponseError as e:
-            self.log.warning(e.code)
-        except asyncio.TimeoutError:
-            self.log.warning("Timeout")
-        except Exception as e:
-            self.log.warning(e)
-        else:
-            return r
-        return
-
-
-    async def fetch_async(self, loop, mods):
-        tasks = []
-        # try to use one client session
-        async with aiohttp.ClientSession() as session:
-            for m in mods:
-                project_id = m.get("id")
-                if project_id is not None:
-                    task = asyncio.ensure_future(self.fetch(session, self.curseforge_url + str(project_id)), loop=loop)
-                    tasks.append(task)
-            # await response outside the for loop
-            responses = await asyncio.gather(*tasks)
-        return responses
+    async def fetch_async(self, mods):
+        # one client session, and batched requests for everything the cache does not have
+        async with HttpClient(self.log) as session:
+            addons = await self.api_cache.get_addons(session, self.curseforge_url, [m["id"] for m in mods if m.get("id") is not None])
+        return list(addons.values())
 
 
     def get_github_data(self):  # single threaded, not needed to be intensive
@@ -75,25 +54,26 @@ class ModList():
 
     def main(self):
         self.log = Log()
+        self.api_cache = ApiCache()
         self.parse = argparse.ArgumentParser(description="Wolfpackmaker / raw_mod_list.py")
         self.parse.add_argument("-v", "--verbose", action="store_true",
                     help="increase output verbosity")
         self.parse.add_argument("-r", "--repo", help="Repo name to search for and generate a mod list description of.")
+        self.parse.add_argument("--api-url", help="CurseForge API addon endpoint, e.g to point at a local fixture server.")
         self.args = self.parse.parse_args()
         self.log.parse_log(self.args)
+        if self.args.api_url:
+            self.curseforge_url = self.args.api_url
         self.log.fancy_intro(self.parse.description)
         self.log.info("Awoo!")
         start_time = time.time()
         loop = asyncio.new_event_loop()
         mods = self.get_github_data()
-        future = asyncio.ensure_future(self.fetch_async(loop, mods), loop=loop)
-        loop.run_until_complete(future)
-        responses = future.result()
+        responses = loop.run_until_complete(self.fetch_async(mods))
         self.log.info(f"Requests took {time.time() - start_time} seconds.")
         start_time = time.time()
         self.data = []
-        for r in responses:
-            json_response = json.loads(r)
+        for json_response in responses:
             try:
                 author = json_response.get("authors")[0]
             except IndexError:
@@ -1,46 +1,86 @@
 
-from posixpath import basename, dirname
 from rich.console import Console
+import json
 import logging
 import time
-from rich import inspect
-from appdirs import user_cache_dir
+from collections import deque
+from pathlib import Path
 import datetime
-from dateutil import tz
-from os import mkdir
 import random
 
-import owoify
-from pyfiglet import Figlet
+# pyfiglet, owoify, dateutil and appdirs are imported where they are used, most runs never need the banner
 
 class Log(Console):
-    log_contents = {}
-    f = Figlet()
+    HISTORY = 1000  # lines kept in memory, the log file gets all of them
 
+    def __init__(self, *args, history=HISTORY, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.history = deque(maxlen=history)
+        self.log_file = None
+        self.log_json = False
+        self.tzinfo = None
+
+    # Filtered lines return before any markup is built or rendered
     def warn(self, msg):
-        logging.root.level <= logging.WARN and self.log(f"[yellow][WARN][white] {msg}")
+        logging.root.level <= logging.WARN and self.log(f"[yellow][WARN][white] {msg}", 'WARN', msg)
     def warning(self, msg):
         self.warn(msg)
     def info(self, msg):
-        logging.root.level <= logging.INFO and self.log(f"[cyan][INFO][white] {msg}")
+        logging.root.level <= logging.INFO and self.log(f"[cyan][INFO][white] {msg}", 'INFO', msg)
     def debug(self, msg):
-        logging.root.level <= logging.DEBUG and self.log(f"[green][DEBUG][white] {msg}")
+        logging.root.level <= logging.DEBUG and self.log(f"[green][DEBUG][white] {msg}", 'DEBUG', msg)
     def critical(self, msg):
-        logging.root.level <= logging.CRITICAL and self.log(f"[red][CRITICAL][white] {msg}")
+        logging.root.level <= logging.CRITICAL and self.log(f"[red][CRITICAL][white] {msg}", 'CRITICAL', msg)
+
+    def is_debug(self):
+        return logging.root.level <= logging.DEBUG
 
-    def log(self, msg):
+    def log(self, msg, level=None, text=None):
         super().log(msg)
-        t = time.time()
-        self.log_contents[t] = msg
-    
-    def parse_log(self, args):
+        record = (time.time(), level, msg if text is None else text)
+        self.history.append(record)
+        self.log_file is not None and self.write_record(record)
+
+    def parse_log(self, args, module=None):
         if args.verbose:
             logging.root.level = logging.DEBUG
             self.debug("Enabling verbose mode.")
         else:
             logging.root.level = logging.INFO
+        self.log_json = getattr(args, 'log_json', False)
+        module and self.open_log(module)
+
+    def open_log(self, module):
+        # Streams every line to the logfile from here on, starting with the ones still in memory
+        from appdirs import user_cache_dir
+        from dateutil import tz
+        self.log_cache = user_cache_dir(f'wolfpackmaker/log/{module}')
+        try:
+            Path(self.log_cache).mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            self.warn(f"Could not save logfile {self.log_cache} with the error {e}.")
+            return
+        self.tzinfo = tz.gettz('EDT')
+        logfile_time = datetime.datetime.fromtimestamp(time.time(), tz=self.tzinfo)
+        logfile_date = datetime.datetime.strftime(logfile_time, "%m_%d_%Y-%H_%M_%S")
+        self.log_path = f"{self.log_cache}/{logfile_date}.{self.log_json and 'jsonl' or 'log'}"
+        self.log_file = open(self.log_path, 'w', buffering=1)
+        for record in self.history:
+            self.write_record(record)
+
+    def write_record(self, record):
+        t, level, msg = record
+        format_time = datetime.datetime.fromtimestamp(t, tz=self.tzinfo)
+        if self.log_json:
+            self.log_file.write(json.dumps({'time': format_time.isoformat(), 'level': level, 'msg': msg}) + "\n")
+        else:
+            format_date = datetime.datetime.strftime(format_time, "%m-%d-%Y-%H:%M:%S")
+            self.log_file.write(f"[{format_date}]{level and f' [{level}]' or ''} {msg}\n")
 
     def fancy_intro(self, description=''):
+        import owoify
+        from pyfiglet import Figlet
+        self.f = Figlet()
         self.info(str('').join(['####' for _ in range(16)]))
         self.info(self.f.renderText(("woofmc.xyz")))
         keywords = random.choice(
@@ -56,31 +96,10 @@ class Log(Console):
         self.info(str('').join(['####' for _ in range(16)]))
 
     def save_log(self, module):
-        self.log_cache = user_cache_dir(f'wolfpackmaker/log/{module}')
-        try:
-            mkdir(self.log_cache)
-        except FileNotFoundError:
-            try:
-                mkdir(dirname(self.log_cache))
-            except FileNotFoundError:
-                mkdir(dirname(dirname(self.log_cache)))
-        except FileExistsError:
-            pass
-        finally:
-            try:
-                mkdir(self.log_cache)
-            except FileNotFoundError as e:
-                self.warn(f"Could not save logfile {self.log_cache} with the error {e}.")
-                return
-            except FileExistsError:
-                pass
-        self.debug("Saving log...")
-        tzinfo = tz.gettz('EDT')
-        logfile_time = datetime.datetime.fromtimestamp(time.time(), tz=tzinfo)
-        logfile_date = datetime.datetime.strftime(logfile_time, "%m_%d_%Y-%H_%M_%S")
-        with open(f"{self.log_cache}/{logfile_date}.log", "w") as f:
-            for k, v in self.log_contents.items():
-                format_time = datetime.datetime.fromtimestamp(k, tz=tzinfo)
-                format_date = datetime.datetime.strftime(format_time, "%m-%d-%Y-%H:%M:%S")
-                f.write(f"[{format_date}] {v}\n")
-
+        if self.log_file is None:
+            self.open_log(module)
+        if self.log_file is None:
+            return
+        self.debug(f"Saved log to {self.log_path}.")
+        self.log_file.close()
+        self.log_file = None
@@ -1,30 +1,42 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
+import hashlib
 import io
 import json
 import platform
+import re
 import shutil
 import sys
-import requests
+import time
 import zipfile
+import zlib
 from appdirs import user_cache_dir
-from os import getcwd, listdir, remove
-from os.path import dirname, exists, join, getsize
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
+from fnmatch import fnmatch
+from os import getcwd, link, listdir, remove, replace, stat
+from os.path import abspath, commonpath, dirname, exists, isabs, join, getsize, normpath, splitdrive
 from pathlib import Path
-from rich.progress import BarColumn, DownloadColumn, Progress, TextColumn, TimeRemainingColumn, TransferSpeedColumn
-from rich.table import Column
+from urllib.parse import quote
+from rich.filesize import decimal
 from wolfpackmaker.util import Log
 
 
 class Wolfpackmaker:
     VERSION = '1.1.1'
+    DOWNLOAD_ATTEMPTS = 3
+    PART_TTL = 7 * 24 * 60 * 60  # seconds a partial download is kept around to resume
     log = Log()
 
     def main(self):
         self.init_args()
         self.parse_args()
-        self.log.parse_log(self.args)
+        if self.args.progress == 'json':
+            # stdout only carries the JSON lines, everything else is logged to stderr
+            self.log.file = sys.stderr
+        self.log.parse_log(self.args, "wolfpackmaker")
 
         self.repo_info = {
             'user': "WolfpackMC",
@@ -50,10 +62,23 @@ class Wolfpackmaker:
 
         self.to_process = []  # mods to process
         self.to_copy_process = [] # mods to copy
+        self.current_mods = set()  # mods in the middle of being downloaded
+        self.failed_mods = []  # mods that could not be verified after every attempt
+        self.verified_files = {}  # path: [size, mtime_ns, inode, algo, hash] of files verified before
+        self.installed_mods = {}  # mods dir: jars this script put there
+        self.store = {}
+
+        self._session = None
 
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
 
+    @property
+    def session(self):
+        # requests and aiohttp are only imported once there is something to fetch
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+            self._session.headers.update(self.headers)
+        return self._session
 
     def parse_args(self):
         self.args = self.parser.parse_args()
@@ -64,17 +89,29 @@ class Wolfpackmaker:
             description='Wolfpackmaker (https://woofmc.xyz)'
         )
         self.parser.add_argument('-v', '--verbose', help='Increase output verbosity.', action='store_true')
+        self.parser.add_argument('--log-json', help='Write the logfile as JSON lines.', action='store_true')
         self.parser.add_argument('-r', '--repo', help='Wolfpack modpack repository from https://github.com/WolfpackMC e.g'
                                                 '--repo Wolfpack-Odin, from https://git.kalka.io/WolfpackMC/Wolfpack-Odin')
         self.parser.add_argument('-mmc', '--multimc', help='Enable MultiMC setup.', action='store_true')
         self.parser.add_argument('-mc', '--minecraft-dir', help='Specify custom minecraft dir. Defaults to .minecraft', default='.minecraft')
         self.parser.add_argument('-d', '--download', help='Custom download directory')
         self.parser.add_argument('--cache', help='Custom cache directory')
+        self.parser.add_argument('--mirror', help='Wolfpackmaker mirror to try before the original download URL e.g http://192.168.1.10:8765')
+        self.parser.add_argument('--serve', help='Serve the mod cache to other installers on [HOST:]PORT instead of installing. Defaults to :8765.',
+                                 nargs='?', const=':8765')
+        self.parser.add_argument('--cache-size', help='Size budget of the mod cache in GB. Defaults to 10.', type=float, default=10)
         self.parser.add_argument('-c', '--clientonly', help='Enable clientonly.', action='store_true', default=False)
         self.parser.add_argument('-s', '--serveronly', help='Enable serveronly.', action='store_true', default=False)
         self.parser.add_argument('-t', '--test', help='Test mode only Does not save any mod jars.', action='store_true', default=False)
+        self.parser.add_argument('-n', '--dry-run', help='Print what would change in the mods folder without changing or downloading anything.',
+                                 action='store_true', default=False)
         self.parser.add_argument('-ni', '--noninteractive', help='Non interactive mode.', action='store_true', default=False)
+        self.parser.add_argument('--no-banner', help='Skip the banner on startup.', action='store_true', default=False)
         self.parser.add_argument('--dir', help=f'Custom directory for Wolfpackmaker. Defaults to {dirname(getcwd())}')
+        self.parser.add_argument('-j', '--jobs', help='Amount of mods to download at once. Defaults to 8.', type=int, default=8)
+        self.parser.add_argument('--host-jobs', help='Maximum connections to a single download host. Defaults to 8.', type=int, default=8)
+        self.parser.add_argument('--progress', help='Download progress output. Defaults to rich, or plain with --noninteractive.',
+                                 choices=['rich', 'plain', 'json'])
 
     
     def assemble_directories(self):
@@ -91,73 +128,197 @@ class Wolfpackmaker:
         self.config_dir = join(self.minecraft_dir, 'config')
         self.mods_cached = join(self.cached_dir, '.cached_mods.json')
         self.modpack_version_cached = join(self.cached_dir, '.modpack_version.txt')
+        self.release_cached = join(self.cached_dir, '.release.json')
+        self.synced_releases_cached = join(self.cached_dir, '.synced_releases.json')
+        self.releases_dir = join(self.cached_dir, 'releases')
+        self.config_index_cached = join(self.cached_dir, '.config_index.json')
 
-    async def retry_mod(self, mod_filename, mod_downloadurl):
-        with self.session.get(mod_downloadurl, stream=True) as r:
-            file = io.BytesIO()
-            for chunk in r.iter_content(65535):
-                file.write(chunk)
-            file.seek(0)
-            with open(join(self.mods_cache_dir, mod_filename), 'wb') as f:
-                f.write(file.getbuffer())
-            file.seek(0)
-            with open(join(self.mods_dir, mod_filename), 'wb') as f:
-                f.write(file.getbuffer())
-    
-    async def save_mod(self, mod_filename, mod_downloadurl, spinner_char, mod_name):
-        with Progress(
-            TextColumn("[progress.description]{task.description}", table_column=Column(ratio=8)),
-            TransferSpeedColumn(table_column=Column(ratio=4)),
-            DownloadColumn(table_column=Column(ratio=4)),
-            BarColumn(bar_width=None, table_column=Column(ratio=2)),
-            "[progress.percentage]{task.percentage:>3.0f}%",
-            TimeRemainingColumn(),
-            refresh_per_second=60,
-            expand=True
-        ) as progress:
-            progress_task = progress.add_task(description=f"[yellow]> [white]{spinner_char} [yellow]{mod_name}...")
+    def create_session(self):
+        # Installs that self-updated from before aiohttp was a requirement may not have it, they download over requests
+        try:
+            import aiohttp
+        except ImportError:
+            import requests
+            self.log.warning("aiohttp is not installed, downloading without it. Install requirements-client.txt for faster downloads.")
+            self.download_errors = (requests.RequestException, asyncio.TimeoutError)
+            return RequestsDownloadSession(self.headers, self.args.jobs)
+        self.download_errors = (aiohttp.ClientError, asyncio.TimeoutError)
+        connector = aiohttp.TCPConnector(limit=self.args.jobs, limit_per_host=self.args.host_jobs)
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers={'User-Agent': self.headers['User-Agent']},
+            skip_auto_headers=['Accept-Encoding'],
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60)
+        )
+
+    async def stream_mod(self, mod_filename, mod_downloadurl, remote_size, hashes, progress_task=None):
+        # Stream into a partial file in the cache, verifying size and hash on the way,
+        # move it into place once verified, then link it into the mods folder.
+        # Partial files are kept along with their validator, so an interrupted download resumes with a Range request.
+        cache_path = self.get_cache_path(mod_filename, hashes)
+        Path(dirname(cache_path)).mkdir(parents=True, exist_ok=True)
+        part_path = f"{cache_path}.part"
+        part_info_path = f"{part_path}.json"
+        algo, expected_hash = pick_hash(hashes)
+        hasher = algo and hashlib.new(algo)
+        size = 0
+        offset = 0
+        headers = {}
+        part_info = {} if self.args.test else read_json(part_info_path)
+        if part_info.get('url') == mod_downloadurl and exists(part_path):
+            validator = part_info.get('etag') or part_info.get('last_modified')
+            offset = getsize(part_path)
+            if validator and 0 < offset < (part_info.get('length') or float('inf')):
+                headers = {'Range': f'bytes={offset}-', 'If-Range': validator}
+        async with self.download_session.get(mod_downloadurl, headers=headers) as r:
+            r.raise_for_status()
+            resumed = r.status == 206 and get_range_start(r.headers.get('content-range')) == offset
+            if r.status == 206 and not resumed:
+                self.log.info(f"Could not resume {mod_filename}, the server sent an unexpected range.")
+                discard_part(part_path)
+                return False
+            if resumed:
+                self.log.debug(f"Resuming {mod_filename} from byte {offset}...")
+                with open(part_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(65535), b''):
+                        hasher and hasher.update(chunk)
+                size = offset
+            try:
+                stream_length = size + int(r.headers['content-length'])
+            except KeyError:
+                stream_length = 0
+            if progress_task is not None:
+                self.progress.start(progress_task, stream_length or remote_size, size)
+            if not self.args.test:
+                etag = r.headers.get('etag')
+                with open(part_info_path, 'w') as f:
+                    f.write(json.dumps({
+                        'url': mod_downloadurl,
+                        'length': stream_length or remote_size,
+                        'etag': etag if etag and not etag.startswith('W/') else None,
+                        'last_modified': r.headers.get('last-modified')
+                    }))
+            with nullcontext() if self.args.test else open(part_path, resumed and 'ab' or 'wb') as f:
+                async for chunk in r.content.iter_chunked(65535):
+                    f is not None and f.write(chunk)
+                    hasher and hasher.update(chunk)
+                    size += len(chunk)
+                    progress_task is not None and self.progress.advance(progress_task, len(chunk))
+        if remote_size and size != remote_size:
+            self.log.info(f"Failed to verify {mod_filename} ({abs(size - remote_size)} byte mismatch).")
+        elif hasher and hasher.hexdigest() != expected_hash.lower():
+            self.log.info(f"Failed to verify {mod_filename} ({algo} mismatch).")
+        else:
+            if not self.args.test:
+                replace(part_path, cache_path)
+                remove(part_info_path)
+                link_mod(cache_path, join(self.mods_dir, mod_filename))
+                if hasher:
+                    self.record_verified(cache_path, algo, hasher.hexdigest())
+                    self.record_verified(join(self.mods_dir, mod_filename), algo, hasher.hexdigest())
+            return True
+        discard_part(part_path)
+        return False
+
+    async def save_mod(self, mod_filename, mod_downloadurl, spinner_char, mod_name, remote_size=None, hashes=None):
+        progress = self.progress
+        progress_task = progress.add(mod_name, spinner_char, remote_size)
+        async with self.download_slots:
             self.download_count[0] += 1
-            with self.session.get(mod_downloadurl, stream=True) as r:
-                file = io.BytesIO()
+            self.current_mods.add(mod_filename)
+            verified = False
+            mirror_url = self.get_mirror_url(mod_filename, hashes)
+            if mirror_url:
+                # One try from the mirror, anything it does not have or gets wrong comes from downloadUrl
+                try:
+                    verified = await self.stream_mod(mod_filename, mirror_url, remote_size, hashes, progress_task)
+                except self.download_errors as e:
+                    self.log.debug(f"Mirror could not send {mod_filename} ({e!r}).")
+                if not verified:
+                    self.log.debug(f"Falling back to {mod_downloadurl} for {mod_filename}...")
+                    progress.reset(progress_task)
+            attempts = not verified and self.DOWNLOAD_ATTEMPTS or 0
+            for attempt in range(1, attempts + 1):
                 try:
-                    stream_length = int(r.headers['content-length'])
-                except KeyError:
-                    stream_length = 0
-                progress.update(progress_task, total=stream_length)
-                for chunk in r.iter_content(65535):
-                    not self.args.test and file.write(chunk)
-                    progress.update(progress_task, advance=len(chunk))
-                if not self.args.test:
-                    file.seek(0)
-                    with open(join(self.mods_cache_dir, mod_filename), 'wb') as f:
-                        f.write(file.getbuffer())
-                    file.seek(0)
-                    with open(join(self.mods_dir, mod_filename), 'wb') as f:
-                        f.write(file.getbuffer())
-                progress.update(progress_task, description=f"[green]> [white]{spinner_char} [green]{mod_name}")
-
-    async def get_raw_data(self, url, to_json=False):
-        with self.session.get(url) as r:
-            if to_json:
-                return r.json()
+                    verified = await self.stream_mod(mod_filename, mod_downloadurl, remote_size, hashes, progress_task)
+                except self.download_errors as e:
+                    self.log.info(f"Failed to download {mod_filename} ({e!r}).")
+                    verified = False
+                if verified:
+                    break
+                if attempt < self.DOWNLOAD_ATTEMPTS:
+                    self.log.info(f"Retrying {mod_filename} ({attempt} of {self.DOWNLOAD_ATTEMPTS})...")
+                    progress.reset(progress_task)
+            self.current_mods.discard(mod_filename)
+            progress.finish(progress_task, verified)
+            if not verified:
+                self.failed_mods.append(mod_filename)
+
+    async def download_mods(self):
+        # Sort mods to download by filesize, largest first so the big jars start early
+        self.tasks = sorted(self.tasks, key=lambda t: t[2] or 0, reverse=True)
+        self.download_slots = asyncio.Semaphore(self.args.jobs)
+        spinner = get_spinner()
+        total_size = sum(t[2] or 0 for t in self.tasks)
+        match self.args.progress or (self.args.noninteractive and 'plain' or 'rich'):
+            case 'rich':
+                self.progress = DownloadDashboard(self.log, total_size, len(self.tasks))
+            case output:
+                self.progress = DownloadLines(self.log, total_size, len(self.tasks), as_json=output == 'json')
+        async with self.create_session() as self.download_session:
+            with self.progress:
+                await asyncio.gather(*[
+                    self.save_mod(filename, download_url, next(spinner), mod_name, remote_size, hashes)
+                    for filename, download_url, remote_size, mod_name, hashes in self.tasks
+                ])
+        if self.failed_mods:
+            self.log.critical(f"Could not verify {len(self.failed_mods)} mods after {self.DOWNLOAD_ATTEMPTS} attempts: {', '.join(self.failed_mods)}")
+
+    def sync_config(self, config_zip):
+        # Works from the zip's central directory: an entry is only extracted when its size or CRC differs from
+        # the file on disk. CRCs of files on disk are kept in an index keyed by size and mtime, so unchanged
+        # files are not even read. Configs matched by .configignore are left alone once the player has them.
+        try:
+            ignored = config_zip.read('.configignore').decode().splitlines()
+        except KeyError:
+            ignored = []
+        ignored = [i.strip().removeprefix(CONFIG_PREFIX) for i in ignored if i.strip() and not i.startswith('#')]
+        old_index = read_json(self.config_index_cached)
+        index = {}
+        written = 0
+        for info in config_zip.infolist():
+            if info.is_dir():
+                continue
+            if info.filename == 'mmc-pack.json':
+                target = join(self.current_dir, 'mmc-pack.json')
+            elif info.filename.startswith(CONFIG_PREFIX):
+                name = info.filename.removeprefix(CONFIG_PREFIX)
+                target = get_config_target(self.config_dir, name)
+                if target is None:
+                    self.log.warning(f"Skipping {info.filename}, it points outside of the config folder.")
+                    continue
+                if is_config_ignored(name, ignored) and exists(target):
+                    self.log.debug(f"Ignoring {name}...")
+                    continue
             else:
-                return r.content
-    
+                continue
+            crc = get_cached_crc32(target, old_index.get(target))
+            if crc == info.CRC and getsize(target) == info.file_size:
+                index[target] = get_index_entry(target, crc)
+                continue
+            Path(dirname(target)).mkdir(parents=True, exist_ok=True)
+            with config_zip.open(info) as src, open(f"{target}.tmp", 'wb') as dst:
+                shutil.copyfileobj(src, dst, 65535)
+            replace(f"{target}.tmp", target)
+            index[target] = get_index_entry(target, info.CRC)
+            written += 1
+            self.log.debug(f"Updated {info.filename}")
+        self.log.info(f"Updated {written} config files, {len(index) - written} unchanged.")
+        with open(self.config_index_cached, 'w') as f:
+            f.write(json.dumps(index))
+
     def check_for_update(self):
-        # self.log.info("Cleaning mods folder... (It's the only way right now to prevent conflicts :c)")
-        # downloaded_mods = listdir(self.mods_dir)
-        # for mod in downloaded_mods:
-        #     # if exists(f"{self.mods_dir}/{mod}"):
-        #     #     if mod in new_mods:
-        #     #         self.log.debug(f"Not necessary, mod {mod} remained unchanged")
-        #     #         continue
-        #     #     self.log.info(f"Updating {mod}...")
-        #     #     remove(f"{self.mods_dir}/{mod}")
-        #     #     flagged_mods.append(mod)
-        #     #     passolololdfsahbm,dhsewafdwqehgfjasghfdewqhlkjdasbghjdfghaskgdhjasgjdkasghdjgakjdgahsjdas
-        #     remove(f"{self.mods_dir}/{mod}")
-        #     print(f"Removed {mod}")
-        #     self.log.info(mod)
+        # Stale jars of the previous version are removed by the mods folder plan, see plan_mods
         if exists(self.modpack_version_cached):
             with open(self.modpack_version_cached, 'r') as f:
                 self.log.info(self.modpack_version)
@@ -173,38 +334,134 @@ class Wolfpackmaker:
                                 cached_mod_id = m
                     except KeyError:
                         cached_mod_id = self.cached_mod_ids[-1]
-                    #self.log.info("Deleting old versions...")
-                    new_mods = [m['filename'] for m in self.mods]
-                    flagged_mods = []
-                    for fm in flagged_mods:
-                        cached_mod_id['mods'].remove(fm)
                     cached_mod_id['current'] = False
-    
-    async def get_github_data(self):
-        github_json = await self.get_raw_data(self.repo_info['github_api'].format(self.repo_info['user'], self.repo_info['repo']), to_json=True)
+
+    def get_release(self):
+        # The releases list is revalidated with the ETag from the last launch, a 304 does not count against
+        # the GitHub rate limit. The last known release is used when GitHub can not be reached.
+        import requests
+        api_url = self.repo_info['github_api'].format(self.repo_info['user'], self.repo_info['repo'])
+        release_info = read_json(self.release_cached)
+        cached = release_info.get(api_url, {})
+        headers = cached.get('etag') and {'If-None-Match': cached['etag']} or {}
         try:
-            if github_json.get("message") == "Not Found":
-                self.log.info(self.repo_info['github_api'].format(self.repo_info['user'], self.repo_info['repo']))
-                sys.exit(self.log.critical("Release " + github_json.get("message")))
-        except AttributeError:
-            pass
-        assets_list = {}
-        for g in github_json:
-            self.log.info(f"Using {g.get('name')} as the release selector.")
-            self.modpack_version = str(g.get("id"))
-            assets_list.update({"modpack_version": self.modpack_version})
-            try:
-                assets = g.get("assets")
-            except KeyError as e:
-                self.log.critical("Git data not found. Possible typo? Error: {}".format(e))
-                sys.exit(1)
-            for asset in assets:
-                name = asset.get('name')
-                if name in self.repo_info['github_files']:
-                    assets_list.update({asset.get('name'): await self.get_raw_data(asset.get('browser_download_url'))})
-            break
+            r = self.session.get(api_url, headers=headers, timeout=(5, 15))
+            if r.status_code == 304:
+                self.log.debug("Release list is unchanged.")
+                return cached['release']
+            if r.status_code == 404:
+                self.log.info(api_url)
+                sys.exit(self.log.critical("Release Not Found"))
+            r.raise_for_status()
+            github_json = r.json()
+        except (requests.RequestException, ValueError) as e:
+            if not cached.get('release'):
+                sys.exit(self.log.critical(f"Could not get the release list ({e!r})."))
+            self.log.warning(f"Could not get the release list ({e!r}), using the last known release.")
+            return cached['release']
+        if not github_json:
+            sys.exit(self.log.critical("Git data not found. Possible typo?"))
+        g = github_json[0]
+        release = {
+            'id': g.get('id'),
+            'name': g.get('name'),
+            'assets': {a.get('name'): a.get('browser_download_url') for a in g.get('assets', [])
+                       if a.get('name') in self.repo_info['github_files']},
+            # e.g "sha256:5f1c...", what a mirror sends is checked against it
+            'digests': {a.get('name'): a.get('digest') for a in g.get('assets', [])
+                        if a.get('name') in self.repo_info['github_files']}
+        }
+        release_info[api_url] = {'etag': r.headers.get('etag'), 'release': release}
+        with open(self.release_cached, 'w') as f:
+            f.write(json.dumps(release_info))
+        return release
+
+    async def get_github_data(self):
+        # Assets are kept per release id, so they are only downloaded once per release
+        release = self.get_release()
+        self.log.info(f"Using {release['name']} as the release selector.")
+        self.modpack_version = str(release['id'])
+        release_dir = join(self.releases_dir, self.modpack_version)
+        Path(release_dir).mkdir(parents=True, exist_ok=True)
+        assets_list = {"modpack_version": self.modpack_version}
+        for name, url in release['assets'].items():
+            path = join(release_dir, name)
+            if not exists(path):
+                self.log.debug(f"Downloading {name} of {release['name']}...")
+                with open(f"{path}.tmp", 'wb') as f:
+                    f.write(self.get_release_asset(self.modpack_version, name, url, release.get('digests', {}).get(name)))
+                replace(f"{path}.tmp", path)
+            with open(path, 'rb') as f:
+                assets_list[name] = f.read()
+        # Only the releases some repo currently points at are kept
+        current = {str(i['release']['id']) for i in read_json(self.release_cached).values()} | {self.modpack_version}
+        for old in set(listdir(self.releases_dir)) - current:
+            shutil.rmtree(join(self.releases_dir, old), ignore_errors=True)
         return assets_list
 
+    def get_release_asset(self, release_id, name, url, digest=None):
+        # manifest.lock decides which jars get installed, so the mirror is only trusted for assets GitHub
+        # published a sha256 for, and only when what it sends matches it
+        import requests
+        algo, _, expected_hash = (digest or '').partition(':')
+        if self.args.mirror and algo == 'sha256' and expected_hash:
+            try:
+                r = self.session.get(f"{self.args.mirror.rstrip('/')}/releases/{release_id}/{quote(name)}", timeout=(2, 60))
+                r.raise_for_status()
+                if hashlib.sha256(r.content).hexdigest() == expected_hash.lower():
+                    return r.content
+                self.log.warning(f"Mirror sent a {name} that does not match GitHub's digest, falling back to GitHub.")
+            except requests.RequestException as e:
+                self.log.debug(f"Mirror could not send {name} ({e!r}), falling back to GitHub.")
+        r = self.session.get(url, timeout=(5, 60))
+        r.raise_for_status()
+        return r.content
+
+    def get_mirror_url(self, filename, hashes):
+        # Mirrors look mods up by hash when the lockfile has one, by filename otherwise
+        if not self.args.mirror:
+            return None
+        algo, digest = pick_hash(hashes)
+        query = algo and f"?{algo}={digest.lower()}" or ''
+        return f"{self.args.mirror.rstrip('/')}/mods/{quote(filename)}{query}"
+
+    def serve(self):
+        """Serve the mod cache and the cached release assets over HTTP, for other installers' --mirror."""
+        try:
+            from aiohttp import web
+        except ImportError:
+            sys.exit(self.log.critical("--serve needs aiohttp, install requirements-client.txt first."))
+        host, _, port = self.args.serve.rpartition(':')
+        app = web.Application()
+        app.router.add_get('/mods/{filename}', self.handle_mod)
+        app.router.add_get('/releases/{release_id}/{name}', self.handle_release_asset)
+        self.log.info(f"Serving {self.mods_cache_dir} and {self.releases_dir} on http://{host or '0.0.0.0'}:{port}")
+        web.run_app(app, host=host or '0.0.0.0', port=int(port), print=None)
+
+    async def handle_mod(self, request):
+        from aiohttp import web
+        filename = request.match_info['filename']
+        hashes = {algo: request.query[algo] for algo in ('sha1', 'md5') if algo in request.query}
+        if not is_safe_name(filename) or not all(HEX_DIGEST.fullmatch(h) for h in hashes.values()):
+            raise web.HTTPBadRequest()
+        path = self.get_cache_path(filename, hashes)
+        if not exists(path):
+            raise web.HTTPNotFound()
+        self.log.debug(f"Sending {filename} to {request.remote}")
+        # FileResponse handles Range and If-Range, so interrupted downloads resume against the mirror too
+        return web.FileResponse(path)
+
+    async def handle_release_asset(self, request):
+        from aiohttp import web
+        release_id, name = request.match_info['release_id'], request.match_info['name']
+        if not release_id.isdigit() or name not in self.repo_info['github_files']:
+            raise web.HTTPNotFound()
+        path = join(self.releases_dir, release_id, name)
+        if not exists(path):
+            raise web.HTTPNotFound()
+        self.log.debug(f"Sending {name} of release {release_id} to {request.remote}")
+        return web.FileResponse(path)
+
     def create_folders(self):
         Path(self.mods_dir).mkdir(parents=True, exist_ok=True)
         self.log.debug(f"Successfully created directory {self.mods_dir}")
@@ -214,8 +471,6 @@ class Wolfpackmaker:
         self.log.debug(f"Successfully created directory {self.cached_dir}")
         Path(self.mods_cache_dir).mkdir(parents=True, exist_ok=True)
         self.log.debug(f"Successfully created directory {self.mods_cache_dir}")
-        Path(join(self.cached_dir, 'cached_config')).mkdir(parents=True, exist_ok=True)
-        self.log.debug(f"Successfully created directory {self.cached_dir}/cached_config")
 
     def process_lockfile(self, lockfile, clientonly=False, serveronly=False):
         self.mods = []
@@ -228,40 +483,39 @@ class Wolfpackmaker:
                 self.mods.append(mod)
 
     async def get_mods(self, clientonly=False, serveronly=False):
-        self.cached_mod_ids = []
         self.cached_mods = []
-        if exists(self.mods_cached):
-            with open(self.mods_cached, 'r') as f:
-                self.cached_mod_ids = json.loads(f.read())
+        mods_cached = read_json(self.mods_cached)
+        if isinstance(mods_cached, list):  # Written before the verification index was added
+            mods_cached = {'versions': mods_cached}
+        self.cached_mod_ids = mods_cached.get('versions', [])
+        self.verified_files = mods_cached.get('files', {})
+        self.installed_mods = mods_cached.get('installed', {})
+        self.store = mods_cached.get('store', {})  # cache path: size, last use and the mods folders using it
         modpack_version = ''
         if self.args.repo is not None and not '.lock' in self.args.repo:
             assets_list = await self.get_github_data()
             assets_data = json.loads(assets_list.get('manifest.lock'))
             self.mods = assets_data.get("mods")
             self.minecraft_version = assets_data.get("version")
+            modpack_version = self.modpack_version
+            # The synced release is kept per config folder, every instance sharing the cache gets its own sync
+            synced_releases = read_json(self.synced_releases_cached)
+            release_changed = synced_releases.get(abspath(self.config_dir)) != self.modpack_version
             self.check_for_update()
-            with open(self.modpack_version_cached, 'w') as f:
-                f.write(self.modpack_version)
-            ignored_cache = []
-            self.log.info("Updating config...")
-            config_bytes = io.BytesIO(assets_list.get('config.zip'))
-            config_zip = zipfile.ZipFile(config_bytes)
-            cached_config_dir = join(self.cached_dir, 'cached_config')
-            config_zip.extractall(cached_config_dir)
-            if exists(join(cached_config_dir, '.configignore')):
-                with open(join(cached_config_dir, '.configignore'), 'r') as f:
-                    for l in f.read().splitlines():
-                        ignored_cache += [l]
-            self.log.info("Checking for ignored configs...")
-            for c in ignored_cache:
-                if exists(join(self.config_dir, c)):
-                    self.log.info(f"Ignoring {c}...")
-                    remove(join(cached_config_dir, c))
-            self.log.info("Copying new config to directory...")
-            shutil.copytree(join(cached_config_dir, '.minecraft/config'), self.config_dir, dirs_exist_ok=True)
-            if exists(join(cached_config_dir, 'mmc-pack.json')):
-                self.log.info("Copying MultiMC JSON files...")
-                shutil.copy(join(cached_config_dir, 'mmc-pack.json'), self.current_dir)
+            if self.args.dry_run:
+                self.log.info("Dry run, leaving the config alone.")
+            elif release_changed:
+                self.log.info("Updating config...")
+                with zipfile.ZipFile(io.BytesIO(assets_list.get('config.zip'))) as config_zip:
+                    self.sync_config(config_zip)
+            else:
+                self.log.info("Config is up to date.")
+            if not self.args.dry_run:
+                with open(self.modpack_version_cached, 'w') as f:
+                    f.write(self.modpack_version)
+                synced_releases[abspath(self.config_dir)] = self.modpack_version
+                with open(self.synced_releases_cached, 'w') as f:
+                    f.write(json.dumps(synced_releases))
         else:
             if self.args.repo is not None and exists(self.args.repo):
                 self.log.info(f"Using custom lockfile: {self.args.repo}")
@@ -298,12 +552,16 @@ class Wolfpackmaker:
             if self.meme_activated:
                 self.log.critical(f" Detected version {platform.version().lower()}! It's probably Cee...")
         self.log.info("Verifying cached mods...")
+        to_verify = []
         for m in self.mods:
             try:
                 m['resourcepack']
+                if self.args.dry_run:
+                    self.log.info(f"  resourcepack {m['filename']}")
+                    continue
                 self.log.info(f"Saving resourcepack {m['name']}...")
                 resourcepack_r = self.session.get(f"{m['downloadUrl']}")
-                print(join(self.resourcepack_dir, m['filename']))
+                self.log.debug(join(self.resourcepack_dir, m['filename']))
                 with open(join(self.resourcepack_dir, m['filename']), 'wb') as f:
                     f.write(resourcepack_r.content)
                 continue
@@ -328,90 +586,516 @@ class Wolfpackmaker:
                 if found:
                     continue
             self.to_copy_process.append(filename)
-            download_url = m['downloadUrl']
-            remote_size = m['fileLength']
-            if exists(join(self.mods_cache_dir, filename)):
-                # verify mods
-                processed = 0
-                try:
-                    local_size = getsize(join(self.mods_cache_dir, filename))
-                except FileNotFoundError:
-                    local_size = 0
-                try:
-                    mod_dir_size = getsize(join(self.mods_dir, filename))
-                except FileNotFoundError:
-                    mod_dir_size = 0
-                if mod_dir_size == 0 and (local_size == remote_size):
-                    self.log.debug("Using cached {} from {}".format(filename, self.mods_cache_dir))
-                    shutil.copy(f"{self.mods_cache_dir}/{filename}", f"{self.mods_dir}/{filename}")
-                    continue
-                verified = (local_size == remote_size) and (mod_dir_size == remote_size)
-                if not verified:
-                    mismatch_size = (local_size != remote_size and abs(local_size - remote_size)) or (mod_dir_size != remote_size and abs(mod_dir_size - remote_size))
-                    self.log.info(f"Failed to verify cached mod {filename} ({mismatch_size} byte mismatch). Retrying...")
-                    self.to_process.append(filename)
-                    self.tasks.append([filename, download_url, remote_size, m['name']])
-                    continue
+            to_verify.append(m)
+        plan = await self.plan_mods(to_verify)
+        if self.args.dry_run:
+            self.print_plan(plan)
+            return
+        if self.args.test:
+            self.print_plan(plan)
+            plan['remove'] = []
+        await self.apply_plan(plan)
+        self._session is not None and self._session.close()
+        if not self.args.test:
+            self.installed_mods[self.mods_dir] = sorted(set(self.to_copy_process) - set(self.failed_mods))
+            self.update_store(to_verify)
+            self.evict_store()
+        self.log.info("Writing cached mod list to {}...".format(self.mods_cached))
+        verified_files = {path: entry for path, entry in self.verified_files.items() if exists(path)}
+        with open(self.mods_cached, 'w') as f:
+            f.write(json.dumps({'versions': self.cached_mods, 'files': verified_files, 'installed': self.installed_mods,
+                                'store': self.store}))
+
+    def get_cache_path(self, filename, hashes):
+        # The store is content addressed, so every instance sharing the cache links to one copy of each jar.
+        # Mods without a hash (custom URLs) are still cached by filename.
+        algo, digest = pick_hash(hashes)
+        if algo is None:
+            return join(self.mods_cache_dir, filename)
+        digest = digest.lower()
+        return join(self.mods_cache_dir, algo, digest[:2], digest)
+
+    def update_store(self, mods):
+        # This mods folder references exactly the cache paths of its current mods
+        now = time.time()
+        used = {self.get_cache_path(m['filename'], m.get('hashes')) for m in mods}
+        for path, entry in self.store.items():
+            if path not in used and self.mods_dir in entry['refs']:
+                entry['refs'].remove(self.mods_dir)
+        for path in used:
+            if not exists(path):
+                continue
+            entry = self.store.setdefault(path, {'refs': []})
+            entry['size'] = getsize(path)
+            entry['last_used'] = now
+            self.mods_dir in entry['refs'] or entry['refs'].append(self.mods_dir)
+
+    def evict_store(self):
+        # Least recently used jars go first once the store is over budget. A jar is never evicted while a mods
+        # folder that still exists references it, or while another hardlink to it exists anywhere.
+        for path in list(self.store):
+            if not exists(path):
+                del self.store[path]
+                continue
+            self.store[path]['refs'] = [r for r in self.store[path]['refs'] if exists(r)]
+        # Partial downloads are only cleaned up when the same mod is downloaded again, so ones of mods that left
+        # the lockfile are pruned by age. The rest count toward the budget.
+        parts_size = 0
+        for part_path in Path(self.mods_cache_dir).rglob('*.part'):
+            try:
+                part_stat = part_path.stat()
+            except FileNotFoundError:
+                continue
+            if time.time() - part_stat.st_mtime > self.PART_TTL:
+                discard_part(str(part_path))
             else:
-                try:
-                    m['flagged']
-                except KeyError:
-                    self.to_process.append(filename)
-                    self.tasks.append([filename, download_url, remote_size, m['name']])
+                parts_size += part_stat.st_size
+        budget = self.args.cache_size * 1000 ** 3
+        total = sum(e['size'] for e in self.store.values()) + parts_size
+        if total <= budget:
+            return
+        evicted = 0
+        for _, path in sorted((e['last_used'], path) for path, e in self.store.items() if not e['refs']):
+            if total <= budget:
+                break
+            if stat(path).st_nlink > 1:
+                continue
+            remove(path)
+            total -= self.store.pop(path)['size']
+            evicted += 1
+        self.log.info(f"Evicted {evicted} jars from the cache, {decimal(total)} of {decimal(budget)} used.")
+
+    def check_file(self, path, signature, remote_size, algo, expected_hash):
+        # True or False when it can be told from the index, None when the file has to be hashed again
+        if signature is None or (remote_size and signature[0] != remote_size):
+            return False
+        if algo is None:
+            return signature[0] == remote_size
+        entry = self.verified_files.get(path)
+        if entry and entry[:3] == signature and entry[3] == algo:
+            return entry[4] == expected_hash.lower()
+        return None
+
+    def record_verified(self, path, algo, digest):
+        signature = get_signature(path)
+        if signature is not None and algo is not None:
+            self.verified_files[path] = signature + [algo, digest]
+
+    def get_cached_copy(self, m):
+        # Mods cached by filename before the store existed count as cached, apply_plan moves them into the store
+        cache_path = self.get_cache_path(m['filename'], m.get('hashes'))
+        legacy_path = join(self.mods_cache_dir, m['filename'])
+        if cache_path != legacy_path and exists(legacy_path) and not exists(cache_path):
+            return legacy_path
+        return cache_path
+
+    async def plan_mods(self, mods):
+        """Work out what has to happen to the mods folder for this lockfile.
+
+        keep: mods already in place and verified. add and replace: mods that are missing or fail verification,
+        each with whether a verified copy is in the cache. remove: jars installed by an earlier run that the
+        lockfile no longer wants, jars the player added themselves are never touched.
+        Files are checked against the verification index by their size, mtime and inode. Only files whose
+        signature changed are hashed again, on a thread pool.
+        """
+        checks = {}
+        for m in mods:
+            algo, expected_hash = pick_hash(m.get('hashes'))
+            for path in (join(self.mods_dir, m['filename']), self.get_cached_copy(m)):
+                signature = get_signature(path)
+                checks[path] = self.check_file(path, signature, m['fileLength'], algo, expected_hash), algo, expected_hash
+        rehash = [(path, algo, expected_hash) for path, (verified, algo, expected_hash) in checks.items() if verified is None]
+        if rehash:
+            self.log.info(f"Hashing {len(rehash)} changed files...")
+            loop = asyncio.get_running_loop()
+            with ThreadPoolExecutor() as pool:
+                digests = await asyncio.gather(*[loop.run_in_executor(pool, hash_file, path, algo) for path, algo, _ in rehash])
+            for (path, algo, expected_hash), digest in zip(rehash, digests):
+                self.record_verified(path, algo, digest)
+                checks[path] = digest == expected_hash.lower(), algo, expected_hash
+        plan = {'keep': [], 'add': [], 'replace': [], 'remove': []}
+        for m in mods:
+            mod_path = join(self.mods_dir, m['filename'])
+            cached = checks[self.get_cached_copy(m)][0]
+            if checks[mod_path][0]:
+                plan['keep'].append(m)
+            elif exists(mod_path):
+                plan['replace'].append((m, cached))
+            elif cached or not m.get('flagged'):
+                plan['add'].append((m, cached))
+        # Nothing is removed before a run has recorded what it installed in this mods folder, the version history
+        # in .cached_mods.json is shared by every pack and instance so it can not tell our jars from the player's
+        installed = self.installed_mods.get(self.mods_dir, [])
+        wanted = {m['filename'] for m in mods}
+        plan['remove'] = sorted(f for f in listdir(self.mods_dir) if f in installed and f not in wanted)
+        return plan
+
+    def print_plan(self, plan):
+        self.log.info(f"Mods folder plan: {len(plan['keep'])} to keep, {len(plan['add'])} to add, "
+                      f"{len(plan['replace'])} to replace, {len(plan['remove'])} to remove.")
+        for action in ('add', 'replace'):
+            for m, cached in plan[action]:
+                self.log.info(f"  {action} {m['filename']}{cached and ' (from cache)' or ''}")
+        for filename in plan['remove']:
+            self.log.info(f"  remove {filename}")
+
+    async def apply_plan(self, plan):
+        # Stale jars go first so there are never two versions of a mod in the folder, then cached copies are
+        # linked in and everything else is downloaded
+        for filename in plan['remove']:
+            self.log.info(f"Removing {filename}...")
+            remove(join(self.mods_dir, filename))
+        for m in plan['keep']:
+            # Jars that are only in the mods folder, e.g from another cache dir, are linked into the store
+            cache_path = self.get_cache_path(m['filename'], m.get('hashes'))
+            entry = self.verified_files.get(join(self.mods_dir, m['filename']))
+            if entry and not exists(cache_path):
+                Path(dirname(cache_path)).mkdir(parents=True, exist_ok=True)
+                link_mod(join(self.mods_dir, m['filename']), cache_path)
+                self.record_verified(cache_path, entry[3], entry[4])
+        for m, cached in plan['add'] + plan['replace']:
+            filename = m['filename']
+            if cached:
+                self.log.debug("Using cached {} from {}".format(filename, self.mods_cache_dir))
+                cache_path = self.get_cache_path(filename, m.get('hashes'))
+                legacy_path = self.get_cached_copy(m)
+                if legacy_path != cache_path:
+                    Path(dirname(cache_path)).mkdir(parents=True, exist_ok=True)
+                    replace(legacy_path, cache_path)
+                    if legacy_path in self.verified_files:
+                        self.verified_files[cache_path] = self.verified_files.pop(legacy_path)
+                link_mod(cache_path, join(self.mods_dir, filename))
+                entry = self.verified_files.get(cache_path)
+                entry and self.record_verified(join(self.mods_dir, filename), entry[3], entry[4])
+                continue
+            self.to_process.append(filename)
+            self.tasks.append([filename, m['downloadUrl'], m['fileLength'], m['name'], m.get('hashes', {})])
         if self.tasks:
-            from operator import itemgetter
-            # Sort mods to download by filesize
-
-            self.tasks = sorted(self.tasks, key=itemgetter(2))
-            spinner = get_spinner()
-            for file in reversed(self.tasks):
-                spinner_char = next(spinner)
-                filename = file[0]
-                download_url = file[1]
-                mod_name = file[3]
-                self.current_mod = filename
-                await self.save_mod(filename, download_url, spinner_char, mod_name)
-            if not self.args.test:
-                await self.verify_mods()
+            await self.download_mods()
         else:
             self.log.debug("We do not have any mods to process.")
+
+
+class DownloadDashboard:
+    """One rich progress display for the whole download run, a row per active download under an overall total.
+
+    Chunks are tallied and handed to rich at most REFRESH_PER_SECOND times a second, which is also the redraw rate.
+    """
+    REFRESH_PER_SECOND = 4
+
+    def __init__(self, log, total_size, total_mods):
+        from rich.progress import BarColumn, DownloadColumn, Progress, TextColumn, TimeRemainingColumn, TransferSpeedColumn
+        from rich.table import Column
+        self.progress = Progress(
+            TextColumn("[progress.description]{task.description}", table_column=Column(ratio=8)),
+            TransferSpeedColumn(table_column=Column(ratio=4)),
+            DownloadColumn(table_column=Column(ratio=4)),
+            BarColumn(bar_width=None, table_column=Column(ratio=2)),
+            "[progress.percentage]{task.percentage:>3.0f}%",
+            TimeRemainingColumn(),
+            console=log,
+            refresh_per_second=self.REFRESH_PER_SECOND,
+            expand=True
+        )
+        self.total_mods = total_mods
+        self.done_mods = 0
+        self.overall = self.progress.add_task(self.get_overall_description(), total=total_size or None)
+        self.names = {}
+        self.pending = {}
+        self.last_flush = 0
+
+    def get_overall_description(self):
+        return f"[cyan]Total ({self.done_mods} of {self.total_mods} mods)"
+
+    def add(self, name, spinner_char, size=None):
+        # Rows stay hidden until their download starts, so only active downloads are shown
+        task = self.progress.add_task(f"[yellow]> [white]{spinner_char} [yellow]{name}...", total=size, start=False, visible=False)
+        self.names[task] = name
+        return task
+
+    def start(self, task, total, completed=0):
+        self.pending.pop(task, None)
+        self.progress.update(task, total=total or None, completed=completed, visible=True)
+        self.progress.start_task(task)
+        self.update_overall()
+
+    def advance(self, task, size):
+        self.pending[task] = self.pending.get(task, 0) + size
+        if time.monotonic() - self.last_flush >= 1 / self.REFRESH_PER_SECOND:
+            self.flush()
+
+    def flush(self):
+        for task, size in self.pending.items():
+            self.progress.update(task, advance=size)
+        self.pending.clear()
+        self.update_overall()
+        self.last_flush = time.monotonic()
+
+    def update_overall(self):
+        completed = sum(t.completed for t in self.progress.tasks if t.id != self.overall)
+        self.progress.update(self.overall, completed=completed, description=self.get_overall_description())
+
+    def reset(self, task):
+        self.pending.pop(task, None)
+        self.progress.reset(task, start=False)
+
+    def finish(self, task, verified):
+        self.progress.update(task, advance=self.pending.pop(task, 0))
+        self.done_mods += 1
+        if verified:
+            self.progress.update(task, visible=False)
+        else:
+            self.progress.update(task, description=f"[red]> [white]x [red]{self.names[task]}")
+        self.update_overall()
+
+    def cancel(self):
+        for task in self.progress.tasks:
+            if not task.finished:
+                self.progress.update(task.id, description=f"[red]{task.description}")
+
+    def __enter__(self):
+        self.progress.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+        self.progress.stop()
+
+
+class DownloadLines:
+    """Line based download progress for --noninteractive and CI logs, as plain log lines or JSON lines on stdout.
+
+    Prints a line per finished mod, and the overall total at most every INTERVAL seconds. With JSON lines the
+    log is moved to stderr in main, so stdout stays parseable.
+    """
+    INTERVAL = 5
+
+    def __init__(self, log, total_size, total_mods, as_json=False):
+        self.log = log
+        self.as_json = as_json
+        self.total_size = total_size
+        self.total_mods = total_mods
+        self.done_mods = 0
+        self.completed = 0
+        self.tasks = {}
+        self.last_report = time.monotonic()
+
+    def emit(self, event, **fields):
+        if self.as_json:
+            sys.stdout.write(json.dumps({'event': event, **fields}) + '\n')
+            sys.stdout.flush()
+            return
+        progress = f"{decimal(self.completed)} of {decimal(self.total_size)}, {self.done_mods} of {self.total_mods} mods"
+        match event:
+            case 'progress':
+                self.log.info(f"Downloaded {progress}.")
+            case 'done':
+                self.log.info(f"Downloaded {fields['name']} ({progress}).")
+            case 'failed':
+                self.log.info(f"Failed to download {fields['name']} ({progress}).")
+            case 'cancel':
+                self.log.info(f"Canceled at {progress}.")
+
+    def get_totals(self):
+        return {'completed': self.completed, 'total': self.total_size, 'done_mods': self.done_mods, 'total_mods': self.total_mods}
+
+    def add(self, name, spinner_char, size=None):
+        task = len(self.tasks)
+        self.tasks[task] = {'name': name, 'completed': 0}
+        return task
+
+    def start(self, task, total, completed=0):
+        self.completed += completed - self.tasks[task]['completed']
+        self.tasks[task]['completed'] = completed
+
+    def advance(self, task, size):
+        self.tasks[task]['completed'] += size
+        self.completed += size
+        if time.monotonic() - self.last_report >= self.INTERVAL:
+            self.last_report = time.monotonic()
+            self.emit('progress', **self.get_totals())
+
+    def reset(self, task):
+        self.start(task, None, 0)
+
+    def finish(self, task, verified):
+        self.done_mods += 1
+        self.emit(verified and 'done' or 'failed', name=self.tasks[task]['name'], **self.get_totals())
+
+    def cancel(self):
+        self.emit('cancel', **self.get_totals())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class RequestsDownloadSession:
+    """The part of aiohttp's ClientSession that stream_mod uses, over requests, for installs without aiohttp.
+
+    Every blocking call runs on a worker thread, the connection pool is sized for --jobs.
+    """
+
+    def __init__(self, headers, jobs):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        for prefix in ('http://', 'https://'):
+            self.session.mount(prefix, HTTPAdapter(pool_connections=jobs, pool_maxsize=jobs))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
         self.session.close()
-        self.log.info("Writing cached mod list to {}...".format(self.mods_cached))
-        with open(self.mods_cached, 'w') as f:
-            f.write(json.dumps(self.cached_mods))
-    
-    async def verify_mods(self):
-        with Progress() as progress:
-            total = len(self.to_process)
-            verified_task = progress.add_task(description=f"Preparing to verify...", total=total)
-            processed = 0
-            for file in reversed(self.tasks):
-                filename = file[0]
-                download_url = file[1]
-                try:
-                    local_size = getsize(join(self.mods_cache_dir, filename))
-                except FileNotFoundError:
-                    local_size = 0
-                try:
-                    mod_dir_size = getsize(join(self.mods_dir, filename))
-                except FileNotFoundError:
-                    mod_dir_size = 0
-                remote_size = file[2]
-                verified = local_size == remote_size
-                while not verified:
-                    self.log.info(f"Failed to verify cached mod {filename}. Retrying...")
-                    await self.retry_mod(filename, download_url)
-                    local_size = getsize(join(self.mods_cache_dir, filename))
-                    verified = local_size == remote_size
-                verified_mod_dir = mod_dir_size == remote_size
-                while not verified_mod_dir:
-                    self.log.info(f"Failed to verify mod {filename} in mod directory. Retrying...")
-                    await self.retry_mod(filename, download_url)
-                    mod_dir_size = getsize(join(self.mods_dir, filename))
-                    verified = mod_dir_size == remote_size
-                processed += 1
-                progress.update(verified_task, description=f"> Verified {filename}. ({processed}/{total})", advance=1)
-            self.to_process.remove(file[0])
+
+    @asynccontextmanager
+    async def get(self, url, headers=None):
+        r = await asyncio.to_thread(self.session.get, url, headers=headers, stream=True, timeout=(10, 60))
+        try:
+            yield RequestsResponse(r)
+        finally:
+            r.close()
+
+
+class RequestsResponse:
+    def __init__(self, r):
+        self.r = r
+        self.status = r.status_code
+        self.headers = r.headers  # case insensitive, like aiohttp's
+        self.content = self
+
+    def raise_for_status(self):
+        self.r.raise_for_status()
+
+    async def iter_chunked(self, size):
+        chunks = self.r.iter_content(size)
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            yield chunk
+
+
+def read_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def get_signature(path):
+    try:
+        st = stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def hash_file(path, algo):
+    hasher = hashlib.new(algo)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1048576), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+HEX_DIGEST = re.compile(r'[0-9a-fA-F]{32,128}')
+
+
+def is_safe_name(filename):
+    return filename not in ('', '.', '..') and not any(c in filename for c in '/\\\0')
+
+
+CONFIG_PREFIX = '.minecraft/config/'
+
+
+def is_config_ignored(name, ignored):
+    # .configignore lines are paths relative to the config folder, folders or glob patterns
+    return any(name == i or name.startswith(i.rstrip('/') + '/') or fnmatch(name, i) for i in ignored)
+
+
+def get_config_target(config_dir, name):
+    # Zip entry names are untrusted, anything absolute or escaping the config folder with .. is refused
+    name = name.replace('\\', '/')
+    if not name or isabs(name) or splitdrive(name)[0]:
+        return None
+    config_dir = abspath(config_dir)
+    target = normpath(join(config_dir, name))
+    if commonpath([config_dir, target]) != config_dir or target == config_dir:
+        return None
+    return target
+
+
+def get_index_entry(path, crc):
+    st = stat(path)
+    return [st.st_size, st.st_mtime_ns, crc]
+
+
+def get_cached_crc32(path, entry):
+    try:
+        st = stat(path)
+    except FileNotFoundError:
+        return None
+    if entry and entry[:2] == [st.st_size, st.st_mtime_ns]:
+        return entry[2]
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65535), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    import fcntl  # Not available on Windows, which raises ImportError
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def link_mod(src, dst):
+    """Place a cached mod in the mods folder without writing it again: hardlink, then reflink, then copy."""
+    try:
+        remove(dst)
+    except FileNotFoundError:
+        pass
+    try:
+        link(src, dst)
+        return
+    except OSError:
+        pass
+    try:
+        reflink(src, dst)
+        return
+    except (ImportError, OSError):
+        pass
+    shutil.copyfile(src, dst)
+
+
+def discard_part(part_path):
+    for path in (part_path, f"{part_path}.json"):
+        try:
+            remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def get_range_start(content_range):
+    # e.g "bytes 1000-4999/5000"
+    try:
+        return int(content_range.split()[1].split('-')[0])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def pick_hash(hashes):
+    for algo in ('sha1', 'md5'):
+        if hashes and hashes.get(algo):
+            return algo, hashes[algo]
+    return None, None
 
 
 def get_spinner():
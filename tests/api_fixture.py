@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# Stand-in for the CurseForge addon API, for checking the batched lookups of raw_mod_list.py and modpackmaker.py
+# without touching the real API. Run it on its own, or use make_app from check_batching.py.
+
+import argparse
+import io
+import json
+import zipfile
+
+from aiohttp import web
+from collections import Counter
+
+API = '/api/v2/addon'
+PACK_ID = 1
+MOD_ID = 1000
+FILE_ID = 5000
+
+
+def get_addon(mod_id):
+    return {
+        'id': mod_id,
+        'name': f'Mod {mod_id}',
+        'slug': f'mod-{mod_id}',
+        'summary': f'Fixture mod {mod_id}',
+        'websiteUrl': f'https://example.invalid/mods/mod-{mod_id}',
+        'downloadCount': mod_id,
+        'authors': [{'name': 'fixture', 'url': 'https://example.invalid'}],
+        'attachments': [{'isDefault': True, 'thumbnailUrl': f'https://example.invalid/{mod_id}.png'}]
+    }
+
+
+def get_file(mod_id, file_id):
+    return {'id': file_id, 'projectId': mod_id, 'fileName': f'mod-{mod_id}.jar',
+            'downloadUrl': f'https://example.invalid/files/{file_id}/mod-{mod_id}.jar'}
+
+
+def get_mod_ids(app):
+    return range(MOD_ID, MOD_ID + app['mod_count'])
+
+
+def make_app(mod_count=250, batch=True):
+    """The fixture app. With batch=False the POST endpoints answer 404, to drive the per-item fallback."""
+    app = web.Application()
+    app['mod_count'] = mod_count
+    app['batch'] = batch
+    app['stats'] = Counter()
+    routes = web.RouteTableDef()
+
+    @routes.get(API + '/{mod_id:\\d+}')
+    async def addon(request):
+        mod_id = int(request.match_info['mod_id'])
+        request.app['stats']['GET addon'] += 1
+        if mod_id == PACK_ID:
+            base = f"{request.scheme}://{request.host}"
+            return web.json_response({**get_addon(PACK_ID), 'slug': 'fixture-pack', 'name': 'Fixture pack', 'latestFiles': [{
+                'displayName': 'Fixture pack 1.0', 'fileDate': '2022-01-01T00:00:00Z', 'gameVersion': ['1.12.2'],
+                'downloadUrl': f"{base}/download/pack.zip"
+            }]})
+        if mod_id not in get_mod_ids(request.app):
+            raise web.HTTPNotFound()
+        return web.json_response(get_addon(mod_id))
+
+    @routes.get(API + '/{mod_id:\\d+}/file/{file_id:\\d+}')
+    async def addon_file(request):
+        request.app['stats']['GET file'] += 1
+        mod_id, file_id = int(request.match_info['mod_id']), int(request.match_info['file_id'])
+        if mod_id not in get_mod_ids(request.app) or file_id != mod_id - MOD_ID + FILE_ID:
+            raise web.HTTPNotFound()
+        return web.json_response(get_file(mod_id, file_id))
+
+    @routes.post(API)
+    async def addons(request):
+        request.app['stats']['POST addon'] += 1
+        if not request.app['batch']:
+            raise web.HTTPNotFound()
+        ids = await request.json()
+        return web.json_response([get_addon(i) for i in ids if i in get_mod_ids(request.app)])
+
+    @routes.post(API + '/files')
+    async def files(request):
+        request.app['stats']['POST files'] += 1
+        if not request.app['batch']:
+            raise web.HTTPNotFound()
+        ids = await request.json()
+        # e.g {"5000": [{"id": 5000, ...}]}, like the real endpoint
+        return web.json_response({str(i): [get_file(i - FILE_ID + MOD_ID, i)] for i in ids
+                                  if i - FILE_ID + MOD_ID in get_mod_ids(request.app)})
+
+    @routes.get('/download/pack.zip')
+    async def pack(request):
+        request.app['stats']['GET pack'] += 1
+        manifest = {
+            'minecraft': {'version': '1.12.2', 'modLoaders': [{'id': 'forge-14.23.5.2860'}]},
+            'files': [{'projectID': i, 'fileID': i - MOD_ID + FILE_ID} for i in get_mod_ids(request.app)]
+        }
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, 'w') as z:
+            z.writestr('manifest.json', json.dumps(manifest))
+        return web.Response(body=data.getvalue(), content_type='application/zip')
+
+    @routes.get('/stats')
+    async def stats(request):
+        return web.json_response(request.app['stats'])
+
+    app.add_routes(routes)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CurseForge API fixture server')
+    parser.add_argument('-p', '--port', help='Port to listen on. Defaults to 8766.', type=int, default=8766)
+    parser.add_argument('-n', '--mods', help='Amount of mods. Defaults to 250.', type=int, default=250)
+    parser.add_argument('--no-batch', help='Answer 404 on the batched endpoints.', action='store_true')
+    args = parser.parse_args()
+    print(f"API at http://127.0.0.1:{args.port}{API}/")
+    web.run_app(make_app(args.mods, not args.no_batch), host='127.0.0.1', port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
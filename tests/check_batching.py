@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Drives raw_mod_list.py and modpackmaker.py against api_fixture.py, once through the batched endpoints and once
+# through the per-item fallback, and checks the request counts and the output. Needs the script requirements.
+
+import asyncio
+import json
+import math
+import subprocess
+import sys
+import tempfile
+import threading
+
+from aiohttp import web
+from os.path import abspath, dirname, join
+
+from api_fixture import API, MOD_ID, PACK_ID, make_app
+
+SCRIPTS = join(dirname(abspath(__file__)), '..', 'src', 'wolfpackmaker')
+BATCH_SIZE = 100  # apicache.BATCH_SIZE
+
+
+def start(app, port):
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', port).start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop, runner
+
+
+def run(script, args, cwd, cache_dir, stdin=None):
+    r = subprocess.run([sys.executable, join(SCRIPTS, script), *args], cwd=cwd, input=stdin, text=True,
+                       capture_output=True, env={'PATH': '', 'XDG_CACHE_HOME': cache_dir, 'COLUMNS': '200'})
+    if r.returncode:
+        sys.exit(f"{script} failed ({r.returncode}):\n{r.stdout}\n{r.stderr}")
+
+
+def expect(stats, expected):
+    stats = {k: v for k, v in stats.items() if v}
+    if stats != expected:
+        sys.exit(f"Expected requests {expected}, got {stats}")
+
+
+def check_raw_mod_list(app, api_url, mods):
+    with tempfile.TemporaryDirectory() as cwd, tempfile.TemporaryDirectory() as cache_dir:
+        with open(join(cwd, 'manifest.lock'), 'w') as f:
+            json.dump({'mods': [{'id': i} for i in range(MOD_ID, MOD_ID + mods)]}, f)
+        run('raw_mod_list.py', ['--api-url', api_url], cwd, cache_dir)
+        batches = math.ceil(mods / BATCH_SIZE)
+        expect(app['stats'], {'POST addon': batches} if app['batch'] else {'POST addon': batches, 'GET addon': mods})
+        with open(join(cwd, 'modlist.json')) as f:
+            modlist = json.load(f)
+        if len(modlist) != mods:
+            sys.exit(f"raw_mod_list.py: expected {mods} mods in modlist.json, got {len(modlist)}")
+        # a second run is served from the API cache
+        stats = app['stats'].copy()
+        app['stats'].clear()
+        run('raw_mod_list.py', ['--api-url', api_url], cwd, cache_dir)
+        expect(app['stats'], {})
+    return stats
+
+
+def check_modpackmaker(app, api_url, mods):
+    with tempfile.TemporaryDirectory() as cwd, tempfile.TemporaryDirectory() as cache_dir:
+        run('modpackmaker.py', [str(PACK_ID), '--api-url', api_url, '--no-lock'], cwd, cache_dir, stdin='n\n')
+        batches = math.ceil(mods / BATCH_SIZE)
+        expected = {'GET addon': 1, 'GET pack': 1, 'POST addon': batches, 'POST files': batches}
+        if not app['batch']:
+            expected.update({'GET addon': 1 + mods, 'GET file': mods})
+        expect(app['stats'], expected)
+        with open(join(cwd, 'modpack_data', 'fixture-pack', 'manifest.yml')) as f:
+            manifest = f.read()
+        resolved = manifest.count('    url: ')
+        if resolved != mods:
+            sys.exit(f"modpackmaker.py: expected {mods} mods in manifest.yml, got {resolved}")
+    return app['stats'].copy()
+
+
+def main():
+    mods = 250
+    for port, batch in ((8767, True), (8768, False)):
+        app = make_app(mods, batch)
+        loop, runner = start(app, port)
+        api_url = f"http://127.0.0.1:{port}{API}/"
+        for name, check in (('raw_mod_list.py', check_raw_mod_list), ('modpackmaker.py', check_modpackmaker)):
+            app['stats'].clear()
+            stats = check(app, api_url, mods)
+            print(f"{name} ({batch and 'batched' or 'fallback'}): {dict(stats)}")
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+
+if __name__ == '__main__':
+    main()